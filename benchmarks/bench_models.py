@@ -0,0 +1,229 @@
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from dots_infrastructure import CalculationServiceHelperFunctions
+from dots_infrastructure.DataClasses import TimeStepInformation
+from dots_infrastructure.Logger import LOGGER
+from dots_infrastructure.test_infra.InfluxDBMock import InfluxDBMock
+
+from benchmarks.bench_startup import simulator_configuration
+from benchmarks.synthetic_esdl import BUILDING_DESCRIPTION, HEAT_PUMP_DESCRIPTION, HEAT_PUMP_POWER, \
+    create_synthetic_energy_system
+
+# Micro benchmarks of the thermal models and macro benchmarks of the service on synthetic ESDLs. Durations are the
+# best of a number of repeats, in seconds per call, where every repeat times a loop of calls long enough to be stable.
+# They are compared against the baselines stored in baselines.json, a benchmark fails when it is more than the
+# threshold slower than its baseline.
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+START_TIME = datetime(2024, 1, 1)
+TIME_STEP = 900
+AIR_TEMPERATURE = 284.65
+SOIL_TEMPERATURE = 290.05
+SOLAR_IRRADIANCE = 100.0
+FORECAST_SAMPLES = 48
+CAPACITIES = {name: BUILDING_DESCRIPTION[name] for name in ['C_in', 'C_out']}
+RESISTANCES = {name: BUILDING_DESCRIPTION[name] for name in ['R_exch', 'R_floor', 'R_vent', 'R_cond']}
+
+
+def best_of(function, repeats: int) -> float:
+    # Every repeat times a loop of calls that takes at least 0.2 s, as found by timeit's autorange
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeats, number=number)) / number
+
+
+def bench_house_update_temperatures(repeats: int) -> float:
+    from heatpumpservice.thermalsystems import House
+    house = House(CAPACITIES, RESISTANCES, BUILDING_DESCRIPTION['A_glass'])
+    house.set_initial_temperatures(HEAT_PUMP_DESCRIPTION['house_temp_0'], HEAT_PUMP_POWER, AIR_TEMPERATURE,
+                                   SOIL_TEMPERATURE, SOLAR_IRRADIANCE)
+    return best_of(lambda: house.update_temperatures(TIME_STEP, AIR_TEMPERATURE, SOIL_TEMPERATURE, SOLAR_IRRADIANCE,
+                                                     1000.0), repeats)
+
+
+def bench_heat_buffer_update_temperature(repeats: int) -> float:
+    from heatpumpservice.thermalsystems import HeatBuffer
+    buffer = HeatBuffer(HEAT_PUMP_DESCRIPTION['buffer_capacitance'])
+    buffer.set_initial_temperature(HEAT_PUMP_DESCRIPTION['buffer_temp_0'])
+    return best_of(lambda: buffer.update_temperature(TIME_STEP, 1000.0, 1000.0), repeats)
+
+
+def bench_house_set_initial_temperatures(repeats: int) -> float:
+    from heatpumpservice.thermalsystems import House
+    house = House(CAPACITIES, RESISTANCES, BUILDING_DESCRIPTION['A_glass'])
+    return best_of(lambda: house.set_initial_temperatures(HEAT_PUMP_DESCRIPTION['house_temp_0'], HEAT_PUMP_POWER,
+                                                          AIR_TEMPERATURE, SOIL_TEMPERATURE, SOLAR_IRRADIANCE),
+                   repeats)
+
+
+def bench_house_ensemble_update_temperatures(repeats: int) -> float:
+    # A sweep of 100 variants, advanced at once
+    from heatpumpservice.thermalsystems import HouseEnsemble
+    ensemble = HouseEnsemble.parameter_sweep(CAPACITIES, RESISTANCES, BUILDING_DESCRIPTION['A_glass'], {
+        'C_in': np.linspace(0.5, 1.5, 10) * CAPACITIES['C_in'],
+        'R_vent': np.linspace(0.5, 1.5, 10) * RESISTANCES['R_vent']})
+    ensemble.set_initial_temperatures(HEAT_PUMP_DESCRIPTION['house_temp_0'], HEAT_PUMP_POWER, AIR_TEMPERATURE,
+                                      SOIL_TEMPERATURE, SOLAR_IRRADIANCE)
+    return best_of(lambda: ensemble.update_temperatures(TIME_STEP, AIR_TEMPERATURE, SOIL_TEMPERATURE,
+                                                        SOLAR_IRRADIANCE, 1000.0), repeats)
+
+
+class SyntheticService:
+    # CalculationServiceHeatPump with InfluxDBMock on a synthetic ESDL, with the inputs of every heat pump as the
+    # calculation functions receive them from HELICS
+    def __init__(self, number_of_heat_pumps: int):
+        from heatpumpservice.heatpump_service import CalculationServiceHeatPump
+
+        self.energy_system, self.esdl_ids = create_synthetic_energy_system(number_of_heat_pumps)
+        CalculationServiceHelperFunctions.get_simulator_configuration_from_environment = \
+            lambda: simulator_configuration(self.esdl_ids)
+        self.service = CalculationServiceHeatPump()
+        self.service.influx_connector = InfluxDBMock()
+        self.simulation_time = START_TIME
+
+    def init_calculation_service(self):
+        self.service.init_calculation_service(self.energy_system)
+
+    def weather_params(self) -> dict:
+        # Subscriptions of all heat pumps to one weather service share their values
+        return {"EnvironmentalProfiles/solar_irradiance/weather": [SOLAR_IRRADIANCE] * FORECAST_SAMPLES,
+                "EnvironmentalProfiles/air_temperature/weather": [AIR_TEMPERATURE] * FORECAST_SAMPLES,
+                "EnvironmentalProfiles/soil_temperature/weather": [SOIL_TEMPERATURE] * FORECAST_SAMPLES}
+
+    def start(self):
+        # Initialise the heat pumps and derive heat powers that keep every heat pump in its initial state
+        self.init_calculation_service()
+        weather_params = self.weather_params()
+        for esdl_id in self.esdl_ids:
+            self.service.send_temperatures(weather_params, self.simulation_time, TimeStepInformation(0, 1), esdl_id,
+                                           self.energy_system)
+        fleet = self.service.fleet
+        ambient_temperatures = np.array([AIR_TEMPERATURE, SOIL_TEMPERATURE])
+        heat_to_house = (np.einsum('nj,nj->n', fleet.K[:, 0], fleet.house_temperatures) -
+                         np.einsum('nj,j->n', fleet.K_amb[:, 0], ambient_temperatures) -
+                         fleet.window_areas * SOLAR_IRRADIANCE)
+        self.update_params = {}
+        for esdl_id, heat in zip(self.esdl_ids, heat_to_house.tolist()):
+            update_params = dict(weather_params)
+            for name, value in [("heat_power_to_tank_dhw", 0.0), ("heat_power_to_dhw", 0.0),
+                                ("heat_power_to_buffer", heat), ("heat_power_to_house", heat)]:
+                update_params[f"EConnection/{name}/connection-{esdl_id}"] = value
+            self.update_params[esdl_id] = update_params
+
+    def cycle(self):
+        # One period of both calculations for all heat pumps
+        service = self.service
+        weather_params = self.weather_params()
+        time_step_information = TimeStepInformation(1, 1)
+        for esdl_id in self.esdl_ids:
+            service.send_temperatures(weather_params, self.simulation_time, time_step_information, esdl_id,
+                                      self.energy_system)
+        for esdl_id in self.esdl_ids:
+            service.update_temperatures(self.update_params[esdl_id], self.simulation_time, time_step_information,
+                                        esdl_id, self.energy_system)
+        self.simulation_time += timedelta(seconds=TIME_STEP)
+
+
+def bench_init_calculation_service(number_of_heat_pumps: int, repeats: int) -> float:
+    synthetic_service = SyntheticService(number_of_heat_pumps)
+    return best_of(synthetic_service.init_calculation_service, repeats)
+
+
+def bench_fleet_step(number_of_heat_pumps: int, repeats: int) -> float:
+    synthetic_service = SyntheticService(number_of_heat_pumps)
+    synthetic_service.start()
+    fleet = synthetic_service.service.fleet
+    return best_of(lambda: fleet.step(TIME_STEP), repeats)
+
+
+def bench_send_update_cycle(number_of_heat_pumps: int, repeats: int) -> float:
+    synthetic_service = SyntheticService(number_of_heat_pumps)
+    synthetic_service.start()
+    try:
+        return best_of(synthetic_service.cycle, repeats)
+    finally:
+        synthetic_service.service.output_writer.close()
+
+
+MICRO_BENCHMARKS = {
+    "house.update_temperatures": bench_house_update_temperatures,
+    "heat_buffer.update_temperature": bench_heat_buffer_update_temperature,
+    "house.set_initial_temperatures": bench_house_set_initial_temperatures,
+    "house_ensemble.update_temperatures/100": bench_house_ensemble_update_temperatures,
+}
+MACRO_BENCHMARKS = {
+    "init_calculation_service": bench_init_calculation_service,
+    "fleet.step": bench_fleet_step,
+    "send_update_cycle": bench_send_update_cycle,
+}
+
+
+def run_benchmarks(sizes, repeats: int, names=None) -> dict:
+    results = {}
+    for name, benchmark in MICRO_BENCHMARKS.items():
+        if names is None or name in names:
+            results[name] = benchmark(repeats)
+    for name, benchmark in MACRO_BENCHMARKS.items():
+        if names is None or name in names:
+            for number_of_heat_pumps in sizes:
+                results[f"{name}/{number_of_heat_pumps}"] = benchmark(number_of_heat_pumps, repeats)
+    return results
+
+
+def compare_with_baselines(results: dict, baselines: dict, threshold: float) -> list:
+    # Names of the benchmarks that are more than threshold (a fraction) slower than their baseline
+    regressions = []
+    for name, duration in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:40s} {duration * 1e6:14.1f} us   no baseline")
+            continue
+        ratio = duration / baseline
+        regressed = ratio > 1.0 + threshold
+        print(f"{name:40s} {duration * 1e6:14.1f} us   baseline {baseline * 1e6:14.1f} us   {ratio:5.2f}x"
+              f"{'   REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks of the heat pump models and service")
+    parser.add_argument("--heat-pumps", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--benchmarks", nargs="+", help="names of the benchmarks to run, all by default")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail when a benchmark is this fraction slower than its baseline")
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    args = parser.parse_args()
+
+    # The service logs per heat pump and per calculation, which would dominate the measurements
+    LOGGER.setLevel(logging.WARNING)
+
+    results = run_benchmarks(args.heat_pumps, args.repeats, args.benchmarks)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as baselines_file:
+            baselines = json.load(baselines_file)
+    regressions = compare_with_baselines(results, baselines, args.threshold)
+
+    if args.update_baselines:
+        baselines.update({name: float(f"{duration:.4g}") for name, duration in results.items()})
+        with open(args.baselines, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+            baselines_file.write("\n")
+    elif regressions:
+        sys.exit(f"Benchmarks {regressions} are more than {args.threshold:.0%} slower than their baselines")
+
+
+if __name__ == "__main__":
+    main()
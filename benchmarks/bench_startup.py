@@ -0,0 +1,71 @@
+import argparse
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import helics as h
+
+from dots_infrastructure import CalculationServiceHelperFunctions
+from dots_infrastructure.DataClasses import SimulatorConfiguration
+
+from benchmarks.synthetic_esdl import create_synthetic_energy_system
+
+
+def simulator_configuration(esdl_ids):
+    return SimulatorConfiguration("HeatPump", esdl_ids, "Mock-HeatPump", "127.0.0.1", 23404, "benchmark", 86400,
+                                  datetime(2024, 1, 1), "test-host", "test-port", "test-username", "test-password",
+                                  "test-database-name", h.HelicsLogLevel.WARNING, ["EnvironmentalProfiles", "EConnection"])
+
+
+def best_of(function, repeats: int) -> float:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def cold_import_duration(module: str) -> float:
+    # Import time of module in a fresh interpreter, as at the start of a container
+    script = f"import time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of init_calculation_service on synthetic ESDLs")
+    parser.add_argument("--heat-pumps", type=int, nargs="+", default=[100, 1000, 2500])
+    parser.add_argument("--extra-assets-per-building", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--budget-seconds", type=float,
+                        help="fail when the cold import plus init_calculation_service takes longer")
+    args = parser.parse_args()
+
+    import_duration = min(cold_import_duration("heatpumpservice.heatpump_service") for _ in range(args.repeats))
+    print(f"import heatpumpservice.heatpump_service: {import_duration:.3f} s")
+    offline_import_duration = min(cold_import_duration("heatpumpservice.offline") for _ in range(args.repeats))
+    print(f"import heatpumpservice.offline: {offline_import_duration:.3f} s")
+
+    from heatpumpservice.heatpump_service import CalculationServiceHeatPump
+
+    over_budget = []
+
+    for number_of_heat_pumps in args.heat_pumps:
+        energy_system, esdl_ids = create_synthetic_energy_system(number_of_heat_pumps,
+                                                                 extra_assets_per_building=args.extra_assets_per_building)
+        number_of_assets = sum(1 for obj in energy_system.eAllContents() if hasattr(obj, "id"))
+        CalculationServiceHelperFunctions.get_simulator_configuration_from_environment = lambda: simulator_configuration(esdl_ids)
+        service = CalculationServiceHeatPump()
+        duration = best_of(lambda: service.init_calculation_service(energy_system), args.repeats)
+        print(f"init_calculation_service: {number_of_heat_pumps} heat pumps, {number_of_assets} ESDL objects: {duration:.3f} s")
+        if args.budget_seconds is not None and import_duration + duration > args.budget_seconds:
+            over_budget.append(number_of_heat_pumps)
+
+    if over_budget:
+        sys.exit(f"Startup of {over_budget} heat pumps exceeds the budget of {args.budget_seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import json
+from typing import List, Tuple
+
+from esdl import esdl
+
+BUILDING_DESCRIPTION = {"C_in": 26146400.0, "C_out": 78439200.0, "R_exch": 0.0012422360248447205,
+                        "R_floor": 0.011182795699309515, "R_vent": 0.015427670676349235,
+                        "R_cond": 0.0026857633907758074, "A_glass": 31.39}
+HEAT_PUMP_DESCRIPTION = {"buffer_capacitance": 1547710.0, "buffer_temp_set": 313.15, "buffer_temp_min": 298.15,
+                         "buffer_temp_max": 338.15, "buffer_temp_0": 315.93853596915767, "buffer_temp_hor": 313.15,
+                         "dhw_capacitance": 1254900.0, "dhw_temp_set": 328.15, "dhw_temp_min": 298.15,
+                         "dhw_temp_max": 358.15, "dhw_temp_0": 318.6502151044533, "dhw_temp_hor": 328.15,
+                         "dhw_temp_tap": 288.15, "heat_element": 3000.0, "cop_element": 1.0,
+                         "house_temp_set": 292.65, "house_temp_min": 291.84999999999997, "house_temp_max": 293.45,
+                         "house_temp_0": 292.4459134830428, "house_temp_hor": 292.65}
+HEAT_PUMP_POWER = 18500.0
+
+
+def create_synthetic_energy_system(number_of_heat_pumps: int, number_of_archetypes: int = 10,
+                                   extra_assets_per_building: int = 2) -> Tuple[esdl.EnergySystem, List[str]]:
+    # Every building holds one heat pump, an EConnection and extra_assets_per_building - 1 PV installations.
+    # Buildings cycle through number_of_archetypes distinct thermal descriptions.
+    energy_system = esdl.EnergySystem(id="synthetic-energy-system", name="SyntheticESDL")
+    instance = esdl.Instance(id="synthetic-instance", name="instance")
+    area = esdl.Area(id="synthetic-area", name="area")
+    instance.area = area
+    energy_system.instance.append(instance)
+
+    archetypes = []
+    for archetype in range(number_of_archetypes):
+        building_description = dict(BUILDING_DESCRIPTION)
+        building_description["C_in"] *= 1.0 + 0.05 * archetype
+        building_description["C_out"] *= 1.0 + 0.05 * archetype
+        archetypes.append(json.dumps(building_description))
+    heat_pump_description = json.dumps(HEAT_PUMP_DESCRIPTION)
+
+    heat_pump_ids = []
+    for i in range(number_of_heat_pumps):
+        building = esdl.Building(id=f"building-{i}", name=f"Home{i}", description=archetypes[i % number_of_archetypes])
+        heat_pump = esdl.HeatPump(id=f"heat-pump-{i}", name=f"hp_Home{i}", power=HEAT_PUMP_POWER,
+                                  description=heat_pump_description)
+        building.asset.append(heat_pump)
+        building.asset.append(esdl.EConnection(id=f"connection-{i}", name=f"ConnectionHome{i}"))
+        for j in range(extra_assets_per_building - 1):
+            building.asset.append(esdl.PVInstallation(id=f"pv-{i}-{j}", name=f"pv_Home{i}_{j}"))
+        area.asset.append(building)
+        heat_pump_ids.append(heat_pump.id)
+    return energy_system, heat_pump_ids
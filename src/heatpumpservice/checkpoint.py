@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+import json
+import os
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+from dots_infrastructure.Logger import LOGGER
+
+if TYPE_CHECKING:
+    from dots_infrastructure.DataClasses import EsdlId
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class StateCheckpoint:
+    # Snapshots of the heat pump states in a memory-mapped file of float64 values with two slots that are written in
+    # turn, so the latest complete snapshot survives a crash while writing. A slot is laid out as
+    # [sequence, simulation time, indoor temperatures (N), envelope temperatures (N), buffer temperatures (N),
+    #  dhw temperatures (N), sequence]; a slot is complete when both sequence numbers match.
+    # The esdl_ids belonging to the rows are kept in a json file next to it. Without resume an existing file is reset.
+    def __init__(self, path: str, esdl_ids: List[EsdlId], resume: bool = False):
+        self.path = path
+        self.esdl_ids = list(esdl_ids)
+        n = len(self.esdl_ids)
+        self.slot_size = 4 * n + 3
+
+        esdl_ids_path = f"{path}.json"
+        if resume and os.path.exists(path) and os.path.exists(esdl_ids_path):
+            with open(esdl_ids_path) as esdl_ids_file:
+                stored_esdl_ids = json.load(esdl_ids_file)
+            if stored_esdl_ids != self.esdl_ids:
+                raise ValueError(f"Checkpoint {path} belongs to other heat pumps")
+            self.snapshots = np.memmap(path, dtype=np.float64, mode='r+', shape=(2, self.slot_size))
+        else:
+            with open(esdl_ids_path, 'w') as esdl_ids_file:
+                json.dump(self.esdl_ids, esdl_ids_file)
+            self.snapshots = np.memmap(path, dtype=np.float64, mode='w+', shape=(2, self.slot_size))
+
+        self.sequence = int(max(self._complete_sequence(slot) for slot in range(2)))
+
+    def _complete_sequence(self, slot: int) -> float:
+        snapshot = self.snapshots[slot]
+        return snapshot[0] if snapshot[0] == snapshot[-1] else 0.0
+
+    def write(self, simulation_time: datetime, house_temperatures: np.ndarray, buffer_temperatures: np.ndarray,
+              dhw_temperatures: np.ndarray):
+        n = len(self.esdl_ids)
+        self.sequence += 1
+        snapshot = self.snapshots[self.sequence % 2]
+        snapshot[-1] = -1.0
+        snapshot[1] = (simulation_time - EPOCH).total_seconds()
+        snapshot[2:2 + n] = house_temperatures[:, 0]
+        snapshot[2 + n:2 + 2 * n] = house_temperatures[:, 1]
+        snapshot[2 + 2 * n:2 + 3 * n] = buffer_temperatures
+        snapshot[2 + 3 * n:2 + 4 * n] = dhw_temperatures
+        snapshot[0] = self.sequence
+        snapshot[-1] = self.sequence
+        self.snapshots.flush()
+
+    def read_latest(self) -> Optional[tuple]:
+        # (simulation time, house temperatures (N x 2), buffer temperatures, dhw temperatures) or None
+        if self.sequence == 0:
+            return None
+        n = len(self.esdl_ids)
+        snapshot = np.array(self.snapshots[self.sequence % 2])
+        simulation_time = EPOCH + timedelta(seconds=float(snapshot[1]))
+        house_temperatures = np.stack([snapshot[2:2 + n], snapshot[2 + n:2 + 2 * n]], axis=1)
+        LOGGER.info(f"Read snapshot {self.sequence} of {n} heat pumps at {simulation_time} from {self.path}")
+        return simulation_time, house_temperatures, snapshot[2 + 2 * n:2 + 3 * n], snapshot[2 + 3 * n:2 + 4 * n]
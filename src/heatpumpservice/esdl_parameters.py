@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import TYPE_CHECKING, List, Optional
+
+from dots_infrastructure.Logger import LOGGER
+
+from heatpumpservice.thermalsystems import HeatBuffer, House
+
+if TYPE_CHECKING:
+    from esdl import esdl
+    from dots_infrastructure.DataClasses import EsdlId
+
+# esdl (pyecore) is only imported when an energy system is actually read
+
+
+def find_heat_pump_ids(energy_system: esdl.EnergySystem) -> List[EsdlId]:
+    from esdl import esdl
+    return [obj.id for obj in energy_system.eAllContents() if type(obj) is esdl.HeatPump]
+
+
+def index_esdl_objects(energy_system: esdl.EnergySystem, esdl_ids: List[EsdlId]) -> dict:
+    # Single traversal of the energy system, only the requested ids are kept
+    requested_ids = set(esdl_ids)
+    esdl_objects = {}
+    for obj in energy_system.eAllContents():
+        obj_id = getattr(obj, "id", None)
+        if obj_id in requested_ids:
+            esdl_objects[obj_id] = obj
+
+    missing_ids = [esdl_id for esdl_id in esdl_ids if esdl_id not in esdl_objects]
+    if missing_ids:
+        raise ValueError(f"Heat pumps {missing_ids} are not present in the energy system")
+    return esdl_objects
+
+
+def extract_heat_pump_parameters(energy_system: esdl.EnergySystem, esdl_ids: List[EsdlId]) -> dict:
+    # Returns per esdl_id the heat pump description, its power and the description of the building it is placed in.
+    # Identical description strings are parsed once and share the resulting dict.
+    from esdl import esdl
+    esdl_objects = index_esdl_objects(energy_system, esdl_ids)
+    parsed_descriptions: dict[str, dict] = {}
+
+    def parse_description(description: str) -> dict:
+        if description not in parsed_descriptions:
+            parsed_descriptions[description] = json.loads(description)
+        return parsed_descriptions[description]
+
+    heat_pump_parameters = {}
+    for esdl_id in esdl_ids:
+        hpsystem = esdl_objects[esdl_id]
+        building = hpsystem.eContainer()
+        if not isinstance(building, esdl.Building):
+            raise ValueError(f"Container of heat pump {esdl_id} is not a building")
+        heat_pump_parameters[esdl_id] = {
+            'power': hpsystem.power,
+            'heat_pump': parse_description(hpsystem.description),
+            'building': parse_description(building.description),
+        }
+    return heat_pump_parameters
+
+
+def esdl_content_hash(esdl_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(esdl_path, 'rb') as esdl_file:
+        for chunk in iter(lambda: esdl_file.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _parameter_table_path(cache_directory: str, content_hash: str) -> str:
+    return os.path.join(cache_directory, f"heatpumps-{content_hash}.json")
+
+
+def load_parameter_table(cache_directory: str, content_hash: str) -> Optional[tuple]:
+    # (ids of all heat pumps, parameters per heat pump) of the ESDL with content_hash, or None when not cached
+    table_path = _parameter_table_path(cache_directory, content_hash)
+    if not os.path.exists(table_path):
+        return None
+    with open(table_path) as table_file:
+        table = json.load(table_file)
+    LOGGER.info(f"Read the parameters of {len(table['heat_pump_ids'])} heat pumps from {table_path}")
+    return table['heat_pump_ids'], table['parameters']
+
+
+def store_parameter_table(cache_directory: str, content_hash: str, heat_pump_ids: List[EsdlId],
+                          heat_pump_parameters: dict):
+    # Written to a temporary file first, so services starting at the same time never read a partial table
+    os.makedirs(cache_directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+    with os.fdopen(file_descriptor, 'w') as table_file:
+        json.dump({'heat_pump_ids': list(heat_pump_ids), 'parameters': heat_pump_parameters}, table_file)
+    os.replace(temporary_path, _parameter_table_path(cache_directory, content_hash))
+
+
+def create_thermal_models(esdl_ids: List[EsdlId], heat_pump_parameters: dict):
+    houses: dict[EsdlId, House] = {}
+    buffers: dict[EsdlId, HeatBuffer] = {}
+    dhw_tanks: dict[EsdlId, HeatBuffer] = {}
+    for esdl_id in esdl_ids:
+        hp_description_dict = heat_pump_parameters[esdl_id]['heat_pump']
+        building_description = heat_pump_parameters[esdl_id]['building']
+
+        # Set Tanks
+        buffer_capacitance = hp_description_dict['buffer_capacitance']
+        dhw_capacitance = hp_description_dict['dhw_capacitance']
+        buffers[esdl_id] = HeatBuffer(buffer_capacitance)
+        dhw_tanks[esdl_id] = HeatBuffer(dhw_capacitance)
+        LOGGER.debug('dhw_capacitance: %s', dhw_capacitance)
+
+        # Set Houses
+        capacities = {'C_in': building_description['C_in'], 'C_out': building_description['C_out']}
+        resistances = {'R_exch': building_description['R_exch'], 'R_floor': building_description['R_floor'],
+                       'R_vent': building_description['R_vent'], 'R_cond': building_description['R_cond']}
+        window_area = building_description['A_glass']
+        houses[esdl_id] = House(capacities, resistances, window_area)
+    return houses, buffers, dhw_tanks
@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+from dots_infrastructure.Logger import LOGGER
+
+from heatpumpservice.thermalsystems import HeatBuffer, House, HouseParameters, equilibrium_temperatures
+
+if TYPE_CHECKING:
+    from dots_infrastructure.DataClasses import EsdlId
+
+
+def _stack_house_matrices(houses: dict, esdl_ids: List[EsdlId], name: str) -> np.ndarray:
+    matrices = np.empty((len(esdl_ids), 2, 2))
+    for row, esdl_id in enumerate(esdl_ids):
+        matrices[row] = getattr(houses[esdl_id], name)
+    return matrices
+
+
+# Arrays of the state block of a fleet: name, values per heat pump, dtype and initial value.
+# The state and the staged inputs are kept in one block.
+STATE_BLOCK_ARRAYS = [
+    ('house_temperatures', 2, np.float64, np.nan),
+    ('buffer_temperatures', 1, np.float64, np.nan),
+    ('dhw_temperatures', 1, np.float64, np.nan),
+    ('air_temperatures', 1, np.float64, 0.0),
+    ('soil_temperatures', 1, np.float64, 0.0),
+    ('solar_irradiances', 1, np.float64, 0.0),
+    ('heat_to_dhw_tank', 1, np.float64, 0.0),
+    ('heat_to_dhw', 1, np.float64, 0.0),
+    ('heat_to_buffer', 1, np.float64, 0.0),
+    ('heat_to_house', 1, np.float64, 0.0),
+    ('initialised', 1, np.bool_, False),
+    ('staged', 1, np.bool_, False),
+]
+
+
+# Temperatures that are checked after every step: quantity and the keys of the lower and upper bound in the
+# description of the heat pump. The indoor temperature has no upper bound.
+TEMPERATURE_BOUNDS = [
+    ('dhw', 'dhw_temp_min', 'dhw_temp_max'),
+    ('buffer', 'buffer_temp_min', 'buffer_temp_max'),
+    ('house', 'house_temp_min', None),
+]
+
+
+class BoundsViolationLog:
+    # Temperatures that were clamped to their bounds, one block of arrays per check with violations
+    def __init__(self):
+        self.blocks: List[tuple] = []
+
+    def __len__(self):
+        return sum(len(rows) for _, _, rows, _, _ in self.blocks)
+
+    def record(self, simulation_time, bound_index: int, rows: np.ndarray, values: np.ndarray,
+               clamped_values: np.ndarray):
+        self.blocks.append((simulation_time, bound_index, rows, values, clamped_values))
+
+    def offending_esdl_ids(self, esdl_ids: List[EsdlId]) -> List[EsdlId]:
+        rows = np.unique(np.concatenate([rows for _, _, rows, _, _ in self.blocks])) if self.blocks else []
+        return [esdl_ids[row] for row in rows]
+
+    def summary(self, esdl_ids: List[EsdlId]) -> str:
+        # Number of violations, the offending heat pumps and the largest excess per quantity
+        lines = []
+        for i, (quantity, _, _) in enumerate(TEMPERATURE_BOUNDS):
+            blocks = [block for block in self.blocks if block[1] == i]
+            if not blocks:
+                continue
+            rows = np.concatenate([rows for _, _, rows, _, _ in blocks])
+            excess = np.concatenate([np.abs(values - clamped_values) for _, _, _, values, clamped_values in blocks])
+            lines.append(f"{quantity}: {len(rows)} violations from {blocks[0][0]} to {blocks[-1][0]}, "
+                         f"largest excess {excess.max():.4g} K, heat pumps {[esdl_ids[row] for row in np.unique(rows)]}")
+        return "; ".join(lines)
+
+
+def state_block_size(number_of_heat_pumps: int) -> int:
+    return sum(number_of_heat_pumps * columns * np.dtype(dtype).itemsize for _, columns, dtype, _ in STATE_BLOCK_ARRAYS)
+
+
+class HeatPumpFleet:
+    # All heat pumps of one calculation service in contiguous arrays, row i belongs to esdl_ids[i].
+    # The calculation functions stage their inputs per esdl_id and the whole fleet is advanced at once.
+    def __init__(self, esdl_ids: List[EsdlId], houses: dict, buffers: dict, dhw_tanks: dict):
+        self.esdl_ids = list(esdl_ids)
+        self.index = {esdl_id: row for row, esdl_id in enumerate(self.esdl_ids)}
+        n = len(self.esdl_ids)
+
+        # Parameters, (N x 2 x 2) blocks for the houses and (N) vectors for the tanks
+        self.K = _stack_house_matrices(houses, self.esdl_ids, 'K')
+        self.K_amb = _stack_house_matrices(houses, self.esdl_ids, 'K_amb')
+        self.window_areas = np.array([houses[esdl_id].window_area for esdl_id in self.esdl_ids], dtype=float)
+        # Houses with identical thermal parameters share one HouseParameters entry
+        self.house_parameters: List[HouseParameters] = []
+        parameter_rows = {}
+        for esdl_id in self.esdl_ids:
+            parameters = houses[esdl_id].parameters
+            if id(parameters) not in parameter_rows:
+                parameter_rows[id(parameters)] = len(self.house_parameters)
+                self.house_parameters.append(parameters)
+        self.parameter_index = np.array([parameter_rows[id(houses[esdl_id].parameters)] for esdl_id in self.esdl_ids],
+                                        dtype=np.intp)
+
+        # Propagators of the exact discretisation per time step: (E, B K_amb, first column of B)
+        self.propagators: dict[float, tuple] = {}
+        self.buffer_capacitances = np.array([buffers[esdl_id].capacitance for esdl_id in self.esdl_ids], dtype=float)
+        self.dhw_capacitances = np.array([dhw_tanks[esdl_id].capacitance for esdl_id in self.esdl_ids], dtype=float)
+        # Temperature bounds per heat pump, see set_bounds, unbounded until they are set
+        self.lower_bounds = np.full((len(TEMPERATURE_BOUNDS), n), -np.inf)
+        self.upper_bounds = np.full((len(TEMPERATURE_BOUNDS), n), np.inf)
+
+        # Work arrays of step, so advancing the fleet allocates no arrays
+        self._work_scalars = np.empty(n)
+        self._work_vectors = np.empty((3, n, 2))
+
+        # State and inputs of the next step, views on one state block laid out as in STATE_BLOCK_ARRAYS
+        self.state_block = np.empty(state_block_size(n), dtype=np.uint8)
+        offset = 0
+        for name, columns, dtype, initial_value in STATE_BLOCK_ARRAYS:
+            shape = (n, columns) if columns > 1 else (n,)
+            array = np.ndarray(shape, dtype=dtype, buffer=self.state_block, offset=offset)
+            array[...] = initial_value
+            setattr(self, name, array)
+            offset += array.nbytes
+
+    def __len__(self):
+        return len(self.esdl_ids)
+
+    def bind_models(self, houses: dict, buffers: dict, dhw_tanks: dict):
+        # Let the house and tank models of the heat pumps keep their temperatures in the state block, so they follow
+        # every step of the fleet. The current state of the fleet is kept.
+        for row, esdl_id in enumerate(self.esdl_ids):
+            # bind_* starts from the temperatures of the model, so copy the fleet state over first
+            houses[esdl_id].temperatures = self.house_temperatures[row]
+            buffers[esdl_id].temperature = self.buffer_temperatures[row]
+            dhw_tanks[esdl_id].temperature = self.dhw_temperatures[row]
+            houses[esdl_id].bind_temperatures(self.house_temperatures[row])
+            buffers[esdl_id].bind_temperature(self.buffer_temperatures[row:row + 1])
+            dhw_tanks[esdl_id].bind_temperature(self.dhw_temperatures[row:row + 1])
+
+    def set_state(self, esdl_id: EsdlId, house: House, buffer: HeatBuffer, dhw_tank: HeatBuffer):
+        row = self.index[esdl_id]
+        self.house_temperatures[row] = house.temperatures
+        self.buffer_temperatures[row] = buffer.temperature
+        self.dhw_temperatures[row] = dhw_tank.temperature
+        self.initialised[row] = True
+
+    def restore_state(self, house_temperatures: np.ndarray, buffer_temperatures: np.ndarray,
+                      dhw_temperatures: np.ndarray):
+        self.house_temperatures[:] = house_temperatures
+        self.buffer_temperatures[:] = buffer_temperatures
+        self.dhw_temperatures[:] = dhw_temperatures
+        self.initialised[:] = True
+
+    def initialise(self, hp_description_dicts: dict, nominal_heats: dict, air_temperature: float,
+                   soil_temperature: float, solar_irradiance: float, rows: Optional[np.ndarray] = None):
+        # Initialise every heat pump in rows without a state at once, all heat pumps by default. The weather is that
+        # of all these heat pumps. The tanks start at their initial temperatures and the houses in equilibrium with
+        # the weather, at their initial indoor temperature if the heat pump can keep it.
+        if rows is None:
+            rows = np.flatnonzero(~self.initialised)
+        else:
+            rows = np.asarray(rows)[~self.initialised[rows]]
+        if len(rows) == 0:
+            return
+        esdl_ids = [self.esdl_ids[row] for row in rows]
+        target_indoor_temperatures = np.array([hp_description_dicts[esdl_id]['house_temp_0'] for esdl_id in esdl_ids])
+        house_temperatures, required_heat_to_house = equilibrium_temperatures(
+            self.K[rows], self.K_amb[rows], self.window_areas[rows], target_indoor_temperatures,
+            np.array([nominal_heats[esdl_id] for esdl_id in esdl_ids], dtype=float),
+            air_temperature, soil_temperature, solar_irradiance)
+
+        # If heating was required, it should have been be satisfied by the heat pump and we should be at the set point.
+        # If not, the temperature in the house will be higher then the set point
+        heated = required_heat_to_house >= 0
+        assert np.all(np.abs(target_indoor_temperatures[heated] - house_temperatures[heated, 0]) < 1.0e-3), \
+            'internal temperature should be as provided'
+
+        self.house_temperatures[rows] = house_temperatures
+        self.buffer_temperatures[rows] = [hp_description_dicts[esdl_id]['buffer_temp_0'] for esdl_id in esdl_ids]
+        self.dhw_temperatures[rows] = [hp_description_dicts[esdl_id]['dhw_temp_0'] for esdl_id in esdl_ids]
+        self.initialised[rows] = True
+        LOGGER.info(f"Initialised {len(rows)} heat pumps, {int(heated.sum())} of the houses require heating")
+
+    def stage_inputs(self, esdl_id: EsdlId, air_temperature: float, soil_temperature: float, solar_irradiance: float,
+                     heat_to_dhw_tank: float, heat_to_dhw: float, heat_to_buffer: float, heat_to_house: float):
+        row = self.index[esdl_id]
+        self.air_temperatures[row] = air_temperature
+        self.soil_temperatures[row] = soil_temperature
+        self.solar_irradiances[row] = solar_irradiance
+        self.heat_to_dhw_tank[row] = heat_to_dhw_tank
+        self.heat_to_dhw[row] = heat_to_dhw
+        self.heat_to_buffer[row] = heat_to_buffer
+        self.heat_to_house[row] = heat_to_house
+        self.staged[row] = True
+
+    def set_inputs(self, air_temperatures: np.ndarray, soil_temperatures: np.ndarray, solar_irradiances: np.ndarray,
+                   heat_to_dhw_tank: np.ndarray, heat_to_dhw: np.ndarray, heat_to_buffer: np.ndarray,
+                   heat_to_house: np.ndarray):
+        # Stage the inputs of all heat pumps at once
+        self.air_temperatures[:] = air_temperatures
+        self.soil_temperatures[:] = soil_temperatures
+        self.solar_irradiances[:] = solar_irradiances
+        self.heat_to_dhw_tank[:] = heat_to_dhw_tank
+        self.heat_to_dhw[:] = heat_to_dhw
+        self.heat_to_buffer[:] = heat_to_buffer
+        self.heat_to_house[:] = heat_to_house
+        self.staged[:] = True
+
+    def set_weather(self, air_temperatures: np.ndarray, soil_temperatures: np.ndarray,
+                    solar_irradiances: np.ndarray):
+        # Replace the staged weather of all heat pumps, the staged heat powers are kept
+        self.air_temperatures[:] = air_temperatures
+        self.soil_temperatures[:] = soil_temperatures
+        self.solar_irradiances[:] = solar_irradiances
+
+    def all_inputs_staged(self) -> bool:
+        return bool(self.staged.all())
+
+    def get_propagators(self, time_step: float):
+        if time_step not in self.propagators:
+            # Computed per unique parameter set and gathered to the rows of the fleet
+            number_of_parameter_sets = len(self.house_parameters)
+            E = np.empty((number_of_parameter_sets, 2, 2))
+            B_amb = np.empty((number_of_parameter_sets, 2, 2))
+            B_heat = np.empty((number_of_parameter_sets, 2))
+            for i, parameters in enumerate(self.house_parameters):
+                E[i], B = parameters.get_propagators(time_step)
+                B_amb[i] = np.matmul(B, parameters.K_amb)
+                B_heat[i] = B[:, 0]
+            self.propagators[time_step] = (E[self.parameter_index], B_amb[self.parameter_index],
+                                           B_heat[self.parameter_index])
+        return self.propagators[time_step]
+
+    def forecast(self, esdl_id: EsdlId, time_step: float, ambient_temperatures: np.ndarray,
+                 solar_irradiances: np.ndarray):
+        # Free floating trajectory of the indoor and envelope temperatures over the forecast horizon, without heat
+        # from the heat pump, and the response of those temperatures to a unit heat input to the house held over
+        # the horizon. ambient_temperatures holds the air and soil temperature per sample (horizon x 2).
+        # Both results are (2 x horizon) arrays, the first row holds the indoor and the second the envelope node.
+        row = self.index[esdl_id]
+        parameters = self.house_parameters[self.parameter_index[row]]
+        horizon = len(ambient_temperatures)
+        powers, ambient_map, heat_map = parameters.get_forecast_operators(time_step, horizon)
+
+        solar_heat = self.window_areas[row] * np.asarray(solar_irradiances)
+        trajectory = (np.matmul(powers, self.house_temperatures[row]).ravel() +
+                      np.matmul(ambient_map, np.ravel(ambient_temperatures)) + np.matmul(heat_map, solar_heat))
+        unit_heat_response = heat_map.sum(axis=1)
+        return trajectory.reshape(horizon, 2).T, unit_heat_response.reshape(horizon, 2).T
+
+    def step(self, time_step: float):
+        # Advances all heat pumps
+        if not self.initialised.all():
+            not_initialised = [self.esdl_ids[row] for row in np.flatnonzero(~self.initialised)]
+            raise ValueError(f"Heat pumps {not_initialised} have no initial temperatures")
+
+        # Every operation writes into the state block or the work arrays
+        heat_flow = self._work_scalars
+        propagated, forced, ambient_temperatures = self._work_vectors
+
+        # Tanks: C dT/dt = heat_in - heat_out
+        np.subtract(self.heat_to_dhw_tank, self.heat_to_dhw, out=heat_flow)
+        heat_flow *= time_step
+        heat_flow /= self.dhw_capacitances
+        self.dhw_temperatures += heat_flow
+        np.subtract(self.heat_to_buffer, self.heat_to_house, out=heat_flow)
+        heat_flow *= time_step
+        heat_flow /= self.buffer_capacitances
+        self.buffer_temperatures += heat_flow
+
+        # Houses: C dT/dt = -K T + K_amb T_amb + solar_vector + heat_to_house_vector, integrated exactly
+        # over the time step, which makes every house update one affine map T <- E T + B K_amb T_amb + B q
+        E, B_amb, b_heat = self.get_propagators(time_step)
+        house_temperatures = self.house_temperatures
+        ambient_temperatures[:, 0] = self.air_temperatures
+        ambient_temperatures[:, 1] = self.soil_temperatures
+        np.multiply(self.window_areas, self.solar_irradiances, out=heat_flow)
+        heat_flow += self.heat_to_house
+        np.matmul(E, house_temperatures[:, :, None], out=propagated[:, :, None])
+        np.matmul(B_amb, ambient_temperatures[:, :, None], out=forced[:, :, None])
+        propagated += forced
+        np.matmul(b_heat[:, :, None], heat_flow[:, None, None], out=forced[:, :, None])
+        np.add(propagated, forced, out=house_temperatures)
+
+        self.staged[:] = False
+
+    def set_bounds(self, hp_description_dicts: dict):
+        # Preload the temperature bounds of every heat pump, row i of the bounds belongs to TEMPERATURE_BOUNDS[i]
+        for i, (_, lower_bound_name, upper_bound_name) in enumerate(TEMPERATURE_BOUNDS):
+            for row, esdl_id in enumerate(self.esdl_ids):
+                hp_description_dict = hp_description_dicts[esdl_id]
+                self.lower_bounds[i, row] = hp_description_dict[lower_bound_name]
+                self.upper_bounds[i, row] = hp_description_dict[upper_bound_name] if upper_bound_name else np.inf
+
+    def _bounded_temperatures(self):
+        # Views on the state in the order of TEMPERATURE_BOUNDS
+        return self.dhw_temperatures, self.buffer_temperatures, self.house_temperatures[:, 0]
+
+    def check_bounds(self, violation_log: Optional[BoundsViolationLog] = None, simulation_time=None):
+        # Check whether temperatures did not surpass the limits due to some numerical error, for all heat pumps at
+        # once. Errors up till eps are corrected. Temperatures that are still out of bounds raise one ValueError
+        # naming every offending heat pump, or with a violation_log are clamped to their bounds and recorded.
+        eps = 1.0e-4
+        violations = []
+        for i, temperatures in enumerate(self._bounded_temperatures()):
+            lower_bounds = self.lower_bounds[i]
+            upper_bounds = self.upper_bounds[i]
+            np.copyto(temperatures, lower_bounds + eps, where=np.abs(temperatures - lower_bounds) < eps)
+            np.copyto(temperatures, upper_bounds - eps, where=np.abs(temperatures - upper_bounds) < eps)
+            rows = np.flatnonzero((temperatures < lower_bounds) | (temperatures > upper_bounds))
+            if len(rows) > 0:
+                values = temperatures[rows]
+                violations.append((i, rows, values.copy(), np.clip(values, lower_bounds[rows], upper_bounds[rows])))
+
+        if not violations:
+            return
+        if violation_log is None:
+            raise ValueError("Heat pumps are charged over/under their capacity: " + "; ".join(
+                f"{TEMPERATURE_BOUNDS[i][0]} {[self.esdl_ids[row] for row in rows]}"
+                for i, rows, _, _ in violations))
+        bounded_temperatures = self._bounded_temperatures()
+        for i, rows, values, clamped_values in violations:
+            bounded_temperatures[i][rows] = clamped_values
+            violation_log.record(simulation_time, i, rows, values, clamped_values)
@@ -1,25 +1,59 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
+import time
+IMPORT_START_TIME = time.perf_counter()
+
+from datetime import datetime, timedelta
+import logging
 from esdl import esdl
 import helics as h
 
 from dots_infrastructure.DataClasses import EsdlId, HelicsCalculationInformation, PublicationDescription, SubscriptionDescription, TimeStepInformation
 from dots_infrastructure.HelicsFederateHelpers import HelicsSimulationExecutor
+from dots_infrastructure.Constants import TimeRequestType
 from dots_infrastructure.Logger import LOGGER
 from esdl import EnergySystem
 from dots_infrastructure.CalculationServiceHelperFunctions import get_vector_param_with_name
 
-import json
 import numpy as np
 
-from heatpumpservice.thermalsystems import HeatBuffer, House
+from heatpumpservice.esdl_parameters import create_thermal_models, extract_heat_pump_parameters
+from heatpumpservice.fleet import BoundsViolationLog, HeatPumpFleet
+from heatpumpservice.metrics import HotPathMetrics
+from heatpumpservice.output import BufferedOutputWriter, ColumnarFileSink
+from heatpumpservice.publication import HeatPumpValueFederateExecutor
+from heatpumpservice.settings import get_heat_pump_settings_from_environment
+from heatpumpservice.thermalsystems import HOUSE_PARAMETER_CACHE
+from heatpumpservice.weather import WeatherCache, weather_source_keys
+
+IMPORT_DURATION_IN_SECONDS = time.perf_counter() - IMPORT_START_TIME
 
 
 
 class CalculationServiceHeatPump(HelicsSimulationExecutor):
 
+    OUTPUT_NAMES = ['dhw_tank_temperature', 'buffer_temperature', 'house_temperature']
+    # Time between two samples of the weather forecast vectors
+    FORECAST_SAMPLE_PERIOD_IN_SECONDS = 900
+
     def __init__(self):
         super().__init__()
+        self.settings = get_heat_pump_settings_from_environment()
+
+        # Within a calculation period the heat pumps are advanced per forecast sample
+        period = self.settings.calculation_period_in_seconds
+        if period <= 0 or period % self.FORECAST_SAMPLE_PERIOD_IN_SECONDS != 0:
+            raise ValueError(f"Calculation period of {period} s is not a multiple of the forecast sample period of "
+                             f"{self.FORECAST_SAMPLE_PERIOD_IN_SECONDS} s")
+        self.number_of_sub_steps = period // self.FORECAST_SAMPLE_PERIOD_IN_SECONDS
+        # A dots_infrastructure subscriber waits for all of its inputs in every time step and drops them after its
+        # calculation, so a suppressed publication leaves it without a value
+        if self.settings.publication_deadbands and not self.settings.subscribers_keep_last_value:
+            raise ValueError("Publication deadbands suppress values that dots_infrastructure subscribers wait for, "
+                             "only set them together with subscribers_keep_last_value")
+        # Weather forecasts decoded once per time step for all heat pumps and both calculations
+        self.weather_cache = WeatherCache()
+        # Latencies of the calculations and their phases, dumped when the simulation stops
+        self.metrics = HotPathMetrics()
 
         subscriptions_values = [
             SubscriptionDescription(esdl_type="EnvironmentalProfiles",
@@ -51,11 +85,21 @@ class CalculationServiceHeatPump(HelicsSimulationExecutor):
                                    esdl_type="HeatPump",
                                    output_name="house_temperatures",
                                    output_unit="K",
+                                   data_type=h.HelicsDataType.VECTOR),
+            PublicationDescription(global_flag=True,
+                                   esdl_type="HeatPump",
+                                   output_name="house_temperature_forecast",
+                                   output_unit="K",
+                                   data_type=h.HelicsDataType.VECTOR),
+            PublicationDescription(global_flag=True,
+                                   esdl_type="HeatPump",
+                                   output_name="house_unit_heat_response",
+                                   output_unit="K/W",
                                    data_type=h.HelicsDataType.VECTOR)
         ]
 
-        heatpump_period_in_seconds = 900
-        self.heatpump_period_in_seconds = 900
+        heatpump_period_in_seconds = period
+        self.heatpump_period_in_seconds = period
 
         calculation_information = HelicsCalculationInformation(
             time_period_in_seconds=heatpump_period_in_seconds,
@@ -101,102 +145,121 @@ class CalculationServiceHeatPump(HelicsSimulationExecutor):
                                     input_type=h.HelicsDataType.DOUBLE)
         ]
 
-        heatpump_update_period_in_seconds = 900
+        heatpump_update_period_in_seconds = period
 
         calculation_information_update = HelicsCalculationInformation(heatpump_update_period_in_seconds, 0, False, False, True, "update_temperatures", subscriptions_values, [], self.update_temperatures)
         self.add_calculation(calculation_information_update)
 
+    def add_calculation(self, info : HelicsCalculationInformation):
+        # As HelicsSimulationExecutor.add_calculation, with the value federate of the heat pump calculations
+        if info.inputs == None:
+            info.inputs = []
+        if info.outputs == None:
+            info.outputs = []
+        info.federate_time_period = info.time_period_in_seconds
+        if len(info.inputs) > 0:
+            info.time_request_type = TimeRequestType.ON_INPUT
+            info.federate_time_period = 0
+        self.calculations.append(HeatPumpValueFederateExecutor(info, self.settings.publication_deadbands,
+                                                               self.metrics))
+
     def init_calculation_service(self, energy_system: esdl.EnergySystem):
+        init_start_time = time.perf_counter()
         self.hp_description_dicts: dict[EsdlId, dict[str, float]] = {}
         self.hp_esdl_power: dict[EsdlId, float] = {}
 
-        self.dhw_tanks: dict[EsdlId, HeatBuffer] = {}
-        self.buffers: dict[EsdlId, HeatBuffer] = {}
-        self.houses: dict[EsdlId, House] = {}
-
-        self.inv_capacitance_matrices: dict[EsdlId, np.array] = {}
-        self.conductance_matrices: dict[EsdlId, np.array] = {}
-        self.forcing_matrices: dict[EsdlId, np.array] = {}
-
+        heat_pump_parameters = extract_heat_pump_parameters(energy_system, self.simulator_configuration.esdl_ids)
         for esdl_id in self.simulator_configuration.esdl_ids:
-            # Initialize heat tanks and houses
-            # Get data from ESDL
-            for obj in energy_system.eAllContents():
-                if hasattr(obj, "id") and obj.id == esdl_id:
-                    hpsystem = obj
-                    if isinstance(obj.eContainer(), esdl.Building):
-                        building_description = json.loads(obj.eContainer().description)
-            self.hp_description_dicts[esdl_id] = json.loads(hpsystem.description)
-            self.hp_esdl_power[esdl_id] = hpsystem.power
-
-            # Set Tanks
-            buffer_capacitance = self.hp_description_dicts[esdl_id]['buffer_capacitance']
-            dhw_capacitance = self.hp_description_dicts[esdl_id]['dhw_capacitance']
-            self.buffers[esdl_id] = HeatBuffer(buffer_capacitance)
-            self.dhw_tanks[esdl_id] = HeatBuffer(dhw_capacitance)
-            LOGGER.debug(f'dhw_capacitance: {dhw_capacitance}')
-
-            # Set Houses
-            capacities = {'C_in': building_description['C_in'], 'C_out': building_description['C_out']}
-            resistances = {'R_exch': building_description['R_exch'], 'R_floor': building_description['R_floor'],
-                           'R_vent': building_description['R_vent'], 'R_cond': building_description['R_cond']}
-            window_area = building_description['A_glass']
-            self.houses[esdl_id] = House(capacities, resistances, window_area)
-
-
+            self.hp_description_dicts[esdl_id] = heat_pump_parameters[esdl_id]['heat_pump']
+            self.hp_esdl_power[esdl_id] = heat_pump_parameters[esdl_id]['power']
+
+        # Initialize heat tanks and houses
+        self.houses, self.buffers, self.dhw_tanks = create_thermal_models(self.simulator_configuration.esdl_ids,
+                                                                          heat_pump_parameters)
+        self.fleet = HeatPumpFleet(self.simulator_configuration.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        self.fleet.bind_models(self.houses, self.buffers, self.dhw_tanks)
+        self.fleet.set_bounds(self.hp_description_dicts)
+        # Without a violation log the first temperature out of its bounds terminates the simulation
+        self.violation_log = BoundsViolationLog() if self.settings.clamp_bound_violations else None
+        # Rows per weather source, see _weather_source_rows
+        self.weather_source_rows = None
+        # Weather of the sub steps of a period per heat pump: air temperature, soil temperature and solar irradiance
+        self.weather_samples = np.empty((3, len(self.fleet), self.number_of_sub_steps))
+        self.output_writer = self._create_output_writer()
+        # Time the state of the fleet belongs to, unknown until the first period is advanced or a snapshot is restored
+        self.state_time = None
+        self.checkpoint = None
+        self.last_checkpoint_time = None
+        if self.settings.checkpoint_path:
+            self._init_checkpoint()
+
+        LOGGER.info(f"{len(self.fleet.house_parameters)} unique house parameter sets for {len(self.fleet)} houses, {HOUSE_PARAMETER_CACHE}")
+        self._check_import_and_init_time(time.perf_counter() - init_start_time)
 
     def send_temperatures(self, param_dict : dict, simulation_time : datetime, time_step_number : TimeStepInformation, esdl_id : EsdlId, energy_system : EnergySystem):
         # START user calc
         LOGGER.info("calculation 'send_temperatures' started")
-        LOGGER.debug(get_vector_param_with_name(param_dict, "air_temperature")[0])
-
-        predicted_solar_irradiances = get_vector_param_with_name(param_dict, "solar_irradiance")[0]
-        predicted_air_temperatures = get_vector_param_with_name(param_dict, "air_temperature")[0]
-        predicted_soil_temperatures = get_vector_param_with_name(param_dict, "soil_temperature")[0]
-
-        # Check if the house and tank temperatures are properly initialized
-        house = self.houses[esdl_id]
-        buffer = self.buffers[esdl_id]
-        dhw_tank = self.dhw_tanks[esdl_id]
-        if (house.temperatures is None) or (buffer.temperature is None) or (dhw_tank.temperature is None):
-            current_solar_irradiance = predicted_solar_irradiances[0]
-            current_air_temperature  = predicted_air_temperatures[0]
-            current_soil_temperature = predicted_soil_temperatures[0]
-
-            hp_description_dict = self.hp_description_dicts[esdl_id]
-
-            dhw_tank.set_initial_temperature(hp_description_dict['dhw_temp_0'])
-            buffer.set_initial_temperature(hp_description_dict['buffer_temp_0'])
-            house.set_initial_temperatures(hp_description_dict['house_temp_0'],
-                                           self.hp_esdl_power[esdl_id],
-                                           current_air_temperature,
-                                           current_soil_temperature,
-                                           current_solar_irradiance)
-
-            self.dhw_tanks[esdl_id] = dhw_tank
-            self.buffers[esdl_id] = buffer
-            self.houses[esdl_id] = house
-
-            house_temperatures_list = house.temperatures.tolist()
-        else:
-            house_temperatures_list = house.temperatures
-
+        metrics = self.metrics
+        calculation_start_time = time.perf_counter()
+
+        weather = self.weather_cache.get(param_dict, simulation_time)
+        predicted_solar_irradiances = weather.solar_irradiances
+        predicted_air_temperatures = weather.air_temperatures
+        predicted_soil_temperatures = weather.soil_temperatures
+        LOGGER.debug("%s", predicted_air_temperatures)
+        metrics.record("phase.input_decode", calculation_start_time)
+
+        # Initialise all heat pumps of a weather source at once with the first weather values that arrive
+        fleet = self.fleet
+        row = fleet.index[esdl_id]
+        if not fleet.initialised[row]:
+            phase_start_time = time.perf_counter()
+            fleet.initialise(self.hp_description_dicts, self.hp_esdl_power, predicted_air_temperatures[0],
+                             predicted_soil_temperatures[0], predicted_solar_irradiances[0],
+                             self._weather_source_rows(esdl_id, weather_source_keys(param_dict)))
+            metrics.record("phase.initialise", phase_start_time)
 
         ret_val = {}
-        ret_val["dhw_temperature"]      = dhw_tank.temperature
-        ret_val["buffer_temperature"]   = buffer.temperature
-        ret_val["house_temperatures"]   = house_temperatures_list
-        LOGGER.info(f"House temperatures: {house.temperatures}")
+        ret_val["dhw_temperature"]      = float(fleet.dhw_temperatures[row])
+        ret_val["buffer_temperature"]   = float(fleet.buffer_temperatures[row])
+        # Published from a view on the fleet state, the next step of the fleet waits for the reaction of the ems
+        ret_val["house_temperatures"]   = fleet.house_temperatures[row]
+
+        # Free floating trajectory and unit heat response over the forecast horizon, one sample per period
+        phase_start_time = time.perf_counter()
+        forecast, unit_heat_response = fleet.forecast(esdl_id, self.FORECAST_SAMPLE_PERIOD_IN_SECONDS,
+                                                      weather.ambient_temperatures, predicted_solar_irradiances)
+        ret_val["house_temperature_forecast"] = forecast.ravel()
+        ret_val["house_unit_heat_response"]   = unit_heat_response.ravel()
+        metrics.record("phase.forecast", phase_start_time)
+        LOGGER.info("House temperatures: %s", ret_val['house_temperatures'])
+
+        metrics.record("calculation.send_temperatures", calculation_start_time)
 
         return ret_val
-    
+
+    def _weather_source_rows(self, esdl_id : EsdlId, source_keys : tuple) -> list:
+        # Rows of the heat pumps subscribed to the same weather source as esdl_id, grouped once from the subscriptions
+        # of the send_temperatures federate. Only the row of esdl_id when these subscriptions are not registered.
+        if self.weather_source_rows is None:
+            self.weather_source_rows = {}
+            for subscribed_esdl_id, inputs in self.calculations[0].input_dict.items():
+                if subscribed_esdl_id in self.fleet.index:
+                    subscribed_source_keys = weather_source_keys({input.helics_sub_key: None for input in inputs})
+                    self.weather_source_rows.setdefault(subscribed_source_keys, []).append(self.fleet.index[subscribed_esdl_id])
+        rows = self.weather_source_rows.get(source_keys, [])
+        return rows if self.fleet.index[esdl_id] in rows else [self.fleet.index[esdl_id]]
+
     def update_temperatures(self, param_dict : dict, simulation_time : datetime, time_step_number : TimeStepInformation, esdl_id : EsdlId, energy_system : EnergySystem):
         # START user calc
         LOGGER.info("calculation 'update_temperatures' started")
+        metrics = self.metrics
+        calculation_start_time = time.perf_counter()
 
-        predicted_solar_irradiances = get_vector_param_with_name(param_dict, "solar_irradiance")[0]
-        predicted_air_temperatures = get_vector_param_with_name(param_dict, "air_temperature")[0]
-        predicted_soil_temperatures = get_vector_param_with_name(param_dict, "soil_temperature")[0]
+        weather = self.weather_cache.get(param_dict, simulation_time)
+        predicted_solar_irradiances = weather.solar_irradiances
+        predicted_air_temperatures = weather.air_temperatures
+        predicted_soil_temperatures = weather.soil_temperatures
         heat_to_dhw_tank = get_vector_param_with_name(param_dict, "heat_power_to_tank_dhw")[0]
         heat_to_dhw = get_vector_param_with_name(param_dict, "heat_power_to_dhw")[0]
         heat_to_buffer = get_vector_param_with_name(param_dict, "heat_power_to_buffer")[0]
@@ -206,90 +269,150 @@ class CalculationServiceHeatPump(HelicsSimulationExecutor):
         current_soil_temperature = predicted_soil_temperatures[0]
         current_solar_irradiance = predicted_solar_irradiances[0]
 
-        dhw_tank = self.dhw_tanks[esdl_id]
-        buffer = self.buffers[esdl_id]
-        house = self.houses[esdl_id]
-
-        LOGGER.debug(f"esdl id: {esdl_id}")
-        LOGGER.debug(f"dhw temperature before: {dhw_tank.temperature}")
-        LOGGER.debug(f"buffer temperature before: {buffer.temperature}")
-        LOGGER.debug(f"house temperatures before: {house.temperatures}")
-
-        LOGGER.debug(f"heat to dhw: {heat_to_dhw}")
-        LOGGER.debug(f"heat to dhw tank: {heat_to_dhw_tank}")
-        LOGGER.debug(f"heat to house: {heat_to_house}")
-        LOGGER.debug(f"heat to buffer: {heat_to_buffer}")
-
-        # Update temperatures
-        dhw_tank.update_temperature(self.heatpump_period_in_seconds,
-                                    heat_to_dhw,
-                                    heat_to_dhw_tank)
-        buffer.update_temperature(self.heatpump_period_in_seconds,
-                                  heat_to_house,
-                                  heat_to_buffer)
-        house.update_temperatures(self.heatpump_period_in_seconds,
-                                  current_air_temperature,
-                                  current_soil_temperature,
-                                  current_solar_irradiance,
-                                  heat_to_house)
-
-        LOGGER.info(f"dhw temperature after: {dhw_tank.temperature}")
-        LOGGER.info(f"buffer temperature after: {buffer.temperature}")
-        LOGGER.info(f"house temperatures after: {house.temperatures}")
-
-        dhw_tank_temperature = dhw_tank.temperature
-        house_temperatures = house.temperatures
-        buffer_temperature = buffer.temperature
-
-        # Check whether temperatures did not surpass the limits due to some numerical error
-        lower_bound_dhw_tank = self.hp_description_dicts[esdl_id]['dhw_temp_min']
-        upper_bound_dhw_tank = self.hp_description_dicts[esdl_id]['dhw_temp_max']
-        lower_bound_buffer = self.hp_description_dicts[esdl_id]['buffer_temp_min']
-        upper_bound_buffer = self.hp_description_dicts[esdl_id]['buffer_temp_max']
-        lower_bound_house = self.hp_description_dicts[esdl_id]['house_temp_min']
-
-        # Correct errors up till error eps
-        eps = 1.0e-4
-        if abs(dhw_tank_temperature - lower_bound_dhw_tank) < eps:
-            dhw_tank_temperature = lower_bound_dhw_tank + eps
-        if abs(dhw_tank_temperature - upper_bound_dhw_tank) < eps:
-            dhw_tank_temperature = upper_bound_buffer - eps
-        if abs(buffer_temperature - lower_bound_buffer) < eps:
-            buffer_temperature = lower_bound_buffer + eps
-        if abs(buffer_temperature - upper_bound_buffer) < eps:
-            buffer_temperature = upper_bound_buffer - eps
-        if abs(house_temperatures[0] - lower_bound_house) < eps:
-            house_temperatures[0] = lower_bound_house + eps
-
-        # Raise errors if the values are still not within boundaries
-        if (dhw_tank_temperature < lower_bound_dhw_tank) or (dhw_tank_temperature > upper_bound_dhw_tank):
-            raise ValueError(f"Heat pump {esdl_id} is charged over/under its dhw capacity")
-        if (buffer_temperature < lower_bound_buffer) or (buffer_temperature > upper_bound_buffer):
-            raise ValueError(f"Heat pump {esdl_id} is charged over/under its buffer capacity")
-        if house_temperatures[0] < lower_bound_house:
-            raise ValueError(f"Heat pump {esdl_id} is charged over/under its house capacity")
-
-        # Save as state
-        dhw_tank.temperature = dhw_tank_temperature
-        buffer.temperature = buffer_temperature
-        house.temperatures = house_temperatures.tolist()
-        self.dhw_tanks[esdl_id] = dhw_tank
-        self.buffers[esdl_id] = buffer
-        self.houses[esdl_id] = house
-
-        # Write to influx
-        self.influx_connector.set_time_step_data_point(esdl_id, 'dhw_tank_temperature',
-                                                      simulation_time, dhw_tank_temperature)
-        self.influx_connector.set_time_step_data_point(esdl_id, 'buffer_temperature',
-                                                      simulation_time, buffer_temperature)
-        self.influx_connector.set_time_step_data_point(esdl_id, 'house_temperature',
-                                                      simulation_time, house_temperatures[0])
+        fleet = self.fleet
+        row = fleet.index[esdl_id]
+        metrics.record("phase.input_decode", calculation_start_time)
+
+        # Only format the state of the heat pump when it is logged
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("esdl id: %s", esdl_id)
+            LOGGER.debug("dhw temperature before: %s", fleet.dhw_temperatures[row])
+            LOGGER.debug("buffer temperature before: %s", fleet.buffer_temperatures[row])
+            LOGGER.debug("house temperatures before: %s", fleet.house_temperatures[row])
+
+            LOGGER.debug("heat to dhw: %s", heat_to_dhw)
+            LOGGER.debug("heat to dhw tank: %s", heat_to_dhw_tank)
+            LOGGER.debug("heat to house: %s", heat_to_house)
+            LOGGER.debug("heat to buffer: %s", heat_to_buffer)
+
+        # Stage the inputs, the whole fleet is updated once the inputs of every heat pump are known
+        fleet.stage_inputs(esdl_id,
+                           current_air_temperature,
+                           current_soil_temperature,
+                           current_solar_irradiance,
+                           heat_to_dhw_tank,
+                           heat_to_dhw,
+                           heat_to_buffer,
+                           heat_to_house)
+        # Weather of the sub steps, the heat powers of the ems are held over the whole period
+        if len(predicted_air_temperatures) < self.number_of_sub_steps:
+            raise ValueError(f"Weather forecast of {len(predicted_air_temperatures)} samples does not cover the "
+                             f"{self.number_of_sub_steps} sub steps of a period")
+        self.weather_samples[0, row] = predicted_air_temperatures[:self.number_of_sub_steps]
+        self.weather_samples[1, row] = predicted_soil_temperatures[:self.number_of_sub_steps]
+        self.weather_samples[2, row] = predicted_solar_irradiances[:self.number_of_sub_steps]
+        if fleet.all_inputs_staged():
+            # The calculation runs on input, a period of another length would be integrated over the wrong time
+            if self.state_time is not None and simulation_time != self.state_time:
+                raise ValueError(f"Inputs at {simulation_time} while the heat pumps are at {self.state_time}, the "
+                                 f"weather and ems must publish every {self.heatpump_period_in_seconds} s")
+            self._advance_fleet(simulation_time)
+            # The state now belongs to the end of the period, a restart continues from there
+            self.state_time = simulation_time + timedelta(seconds=self.heatpump_period_in_seconds)
+            if self.checkpoint is not None and self._checkpoint_due(self.state_time):
+                phase_start_time = time.perf_counter()
+                self.checkpoint.write(self.state_time, fleet.house_temperatures, fleet.buffer_temperatures,
+                                      fleet.dhw_temperatures)
+                self.last_checkpoint_time = self.state_time
+                metrics.record("phase.checkpoint_write", phase_start_time)
 
         LOGGER.info("calculation 'update_temperatures' finished")
+        metrics.record("calculation.update_temperatures", calculation_start_time)
 
         ret_val = {}
         return ret_val
 
+    def _advance_fleet(self, simulation_time : datetime):
+        # Advance all heat pumps over the period, one forecast sample at a time
+        fleet = self.fleet
+        metrics = self.metrics
+        for sub_step in range(self.number_of_sub_steps):
+            phase_start_time = time.perf_counter()
+            if sub_step > 0:
+                fleet.set_weather(self.weather_samples[0, :, sub_step], self.weather_samples[1, :, sub_step],
+                                  self.weather_samples[2, :, sub_step])
+            fleet.step(self.FORECAST_SAMPLE_PERIOD_IN_SECONDS)
+            metrics.record("phase.model_step", phase_start_time)
+
+            phase_start_time = time.perf_counter()
+            sub_step_time = simulation_time + timedelta(seconds=sub_step * self.FORECAST_SAMPLE_PERIOD_IN_SECONDS)
+            fleet.check_bounds(self.violation_log, sub_step_time)
+            metrics.record("phase.bounds_check", phase_start_time)
+
+            phase_start_time = time.perf_counter()
+            self.output_writer.record(sub_step_time, {
+                'dhw_tank_temperature': fleet.dhw_temperatures,
+                'buffer_temperature': fleet.buffer_temperatures,
+                'house_temperature': fleet.house_temperatures[:, 0]
+            })
+            metrics.record("phase.output_write", phase_start_time)
+        metrics.count("fleet.periods")
+        metrics.count("fleet.steps", self.number_of_sub_steps)
+        metrics.count("fleet.heat_pump_steps", self.number_of_sub_steps * len(fleet))
+
+    def _create_output_writer(self):
+        # The outputs are recorded once per forecast sample, either to InfluxDB or to local columnar files
+        output_backend = self.settings.output_backend
+        if output_backend == "influx":
+            return BufferedOutputWriter(self.influx_connector, self.fleet.esdl_ids, self.OUTPUT_NAMES,
+                                        self.settings.output_block_time_steps, self.metrics)
+        if output_backend == "columnar":
+            if not self.settings.output_directory:
+                raise ValueError("The columnar output backend requires an output_directory")
+            number_of_time_steps = (self.simulator_configuration.simulation_duration_in_seconds //
+                                    self.FORECAST_SAMPLE_PERIOD_IN_SECONDS + self.number_of_sub_steps)
+            return ColumnarFileSink(self.settings.output_directory, self.fleet.esdl_ids, self.OUTPUT_NAMES,
+                                    self.simulator_configuration.start_time, self.FORECAST_SAMPLE_PERIOD_IN_SECONDS,
+                                    number_of_time_steps, resume=self.settings.restart_from_checkpoint)
+        raise ValueError(f"Unknown output backend {output_backend}, use influx or columnar")
+
+    def _check_import_and_init_time(self, init_duration_in_seconds : float):
+        # Import of the service module, with the modules it imports first, and init_calculation_service. The start of
+        # the interpreter and the ESDL parsing by the infrastructure are not included.
+        import_and_init_duration = IMPORT_DURATION_IN_SECONDS + init_duration_in_seconds
+        LOGGER.info(f"Service import and init took {import_and_init_duration:.3f} s: import {IMPORT_DURATION_IN_SECONDS:.3f} s, initialisation of {len(self.fleet)} heat pumps {init_duration_in_seconds:.3f} s")
+        budget = self.settings.service_import_and_init_time_budget_in_seconds
+        if budget > 0 and import_and_init_duration > budget:
+            LOGGER.warning(f"Service import and init took {import_and_init_duration:.3f} s, more than the budget of {budget:.3f} s")
+
+    def _init_checkpoint(self):
+        # The checkpoint module is only imported when it is enabled
+        from heatpumpservice.checkpoint import StateCheckpoint
+        self.checkpoint = StateCheckpoint(self.settings.checkpoint_path, self.fleet.esdl_ids,
+                                          self.settings.restart_from_checkpoint)
+        if self.settings.restart_from_checkpoint:
+            snapshot = self.checkpoint.read_latest()
+            if snapshot is None:
+                LOGGER.warning(f"No snapshot found in {self.settings.checkpoint_path}, starting from initial temperatures")
+            else:
+                snapshot_time, house_temperatures, buffer_temperatures, dhw_temperatures = snapshot
+                # The restored state would be published and advanced at the wrong time
+                if snapshot_time != self.simulator_configuration.start_time:
+                    raise ValueError(f"Snapshot in {self.settings.checkpoint_path} is at {snapshot_time} while the simulation starts at {self.simulator_configuration.start_time}, start the simulation at the time of the snapshot")
+                self.fleet.restore_state(house_temperatures, buffer_temperatures, dhw_temperatures)
+                self.last_checkpoint_time = snapshot_time
+                self.state_time = snapshot_time
+
+    def _checkpoint_due(self, state_time : datetime) -> bool:
+        return (self.last_checkpoint_time is None or
+                (state_time - self.last_checkpoint_time).total_seconds() >= self.settings.checkpoint_interval_in_seconds)
+
+    def stop_simulation(self):
+        # Wait for the calculations to finish and hand all buffered outputs to influx before writing them
+        self.exe.shutdown()
+        self.output_writer.close()
+        LOGGER.info(f"{self.weather_cache}")
+        for calculation in self.calculations:
+            if calculation.deadbands:
+                LOGGER.info(f"Calculation {calculation.helics_value_federate_info.calculation_name}: {calculation.publication_summary()}")
+        if self.violation_log:
+            LOGGER.warning(f"{len(self.violation_log)} temperatures were clamped to their bounds: {self.violation_log.summary(self.fleet.esdl_ids)}")
+        LOGGER.info(f"Latencies: {self.metrics.summary()}")
+        if self.settings.metrics_path:
+            self.metrics.dump(self.settings.metrics_path)
+            LOGGER.info(f"Metrics written to {self.settings.metrics_path}")
+        super().stop_simulation()
+
 if __name__ == "__main__":
 
     helics_simulation_executor = CalculationServiceHeatPump()
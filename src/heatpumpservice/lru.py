@@ -0,0 +1,43 @@
+from collections import OrderedDict
+import threading
+from typing import Callable, Hashable
+
+
+class LruCache:
+    # Thread safe LRU cache with hit and miss counts. A missing value is created outside the lock, so two threads
+    # may both create it and the last one is kept.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_create(self, key: Hashable, create: Callable):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            self.misses += 1
+
+        value = create()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return f'{type(self).__name__}(hits={self.hits}, misses={self.misses}, size={len(self)}, maxsize={self.maxsize})'
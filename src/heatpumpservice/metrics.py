@@ -0,0 +1,113 @@
+from bisect import bisect_left
+from collections import Counter
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Latencies and counts of the hot path of the service: the calculation functions, their phases and the time spent
+# waiting on HELICS. Recording is cheap enough to stay enabled, the metrics are dumped when the simulation stops.
+
+# Upper bounds of the latency buckets in seconds, doubling from 1 us to about 1000 s
+BUCKET_BOUNDS = [1.0e-6 * 2.0 ** exponent for exponent in range(31)]
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        # counts[i] holds the durations up to BUCKET_BOUNDS[i], the last bucket the longer ones
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, duration: float):
+        self.counts[bisect_left(BUCKET_BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum:
+            self.maximum = duration
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q quantile, the maximum for the last bucket
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative_count = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'max': self.maximum,
+                'buckets': {f"{bound:.6g}": count for bound, count in zip(BUCKET_BOUNDS, self.counts) if count},
+                'overflow': self.counts[-1]}
+
+
+class HotPathMetrics:
+    # Latency histograms and counts by name, shared by the threads of both calculations
+    def __init__(self):
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start_time: float):
+        # Duration since start_time, a time.perf_counter() value
+        duration = time.perf_counter() - start_time
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(duration)
+
+    def count(self, name: str, increment: int = 1):
+        with self._lock:
+            self.counts[name] += increment
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'latencies_in_seconds': {name: histogram.to_dict()
+                                             for name, histogram in sorted(self.histograms.items())},
+                    'counts': dict(sorted(self.counts.items()))}
+
+    def to_prometheus(self, prefix: str = "heatpumpservice") -> str:
+        # Text exposition format, e.g. for the textfile collector of a node exporter
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                labels = f'name="{name}"'
+                cumulative_count = 0
+                for bound, count in zip(BUCKET_BOUNDS, histogram.counts):
+                    cumulative_count += count
+                    lines.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative_count}')
+                lines.append(f'{prefix}_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_latency_seconds_sum{{{labels}}} {histogram.total!r}')
+                lines.append(f'{prefix}_latency_seconds_count{{{labels}}} {histogram.count}')
+            for name, count in sorted(self.counts.items()):
+                lines.append(f'{prefix}_events_total{{name="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        # Prometheus text format for a .prom path, json otherwise. Written to a temporary file first, so a scraper
+        # never reads a partial file
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, 'w') as metrics_file:
+            metrics_file.write(content)
+        os.replace(temporary_path, path)
+
+    def summary(self) -> str:
+        with self._lock:
+            return ", ".join(f"{name}: {histogram.count} x {1e3 * histogram.total / histogram.count:.3f} ms "
+                             f"(p99 {1e3 * histogram.quantile(0.99):.3f} ms)"
+                             for name, histogram in sorted(self.histograms.items()) if histogram.count)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import argparse
+import csv
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+from dots_infrastructure.Logger import LOGGER
+
+from heatpumpservice.esdl_parameters import (create_thermal_models, esdl_content_hash, extract_heat_pump_parameters,
+                                             find_heat_pump_ids, load_parameter_table, store_parameter_table)
+from heatpumpservice.fleet import BoundsViolationLog, HeatPumpFleet
+from heatpumpservice.weather import WEATHER_INPUTS
+
+if TYPE_CHECKING:
+    from esdl import esdl
+    from dots_infrastructure.DataClasses import EsdlId
+
+# Runs the heat pump models over a full horizon without HELICS. The weather and the heat dispatch of the ems are
+# read from local csv files and the temperatures are written to a local csv file.
+
+HEAT_DISPATCH_INPUTS = ['heat_power_to_tank_dhw', 'heat_power_to_buffer', 'heat_power_to_dhw', 'heat_power_to_house']
+OUTPUT_NAMES = ['dhw_tank_temperature', 'buffer_temperature', 'house_temperature']
+
+
+def load_energy_system(esdl_path: str) -> esdl.EnergySystem:
+    from esdl.esdl_handler import EnergySystemHandler
+    esh = EnergySystemHandler()
+    esh.load_file(esdl_path)
+    return esh.get_energy_system()
+
+
+def load_heat_pump_parameters(esdl_path: str, esdl_ids: Optional[List[EsdlId]] = None,
+                              parameter_cache_directory: Optional[str] = None) -> tuple:
+    # (esdl_ids, parameters per heat pump) of the requested heat pumps, all heat pumps in the ESDL by default.
+    # With a cache directory the parameters of all heat pumps are kept per ESDL content hash, so a following run
+    # of the same ESDL does not parse it.
+    if parameter_cache_directory is None:
+        energy_system = load_energy_system(esdl_path)
+        esdl_ids = esdl_ids if esdl_ids else find_heat_pump_ids(energy_system)
+        return esdl_ids, extract_heat_pump_parameters(energy_system, esdl_ids)
+
+    content_hash = esdl_content_hash(esdl_path)
+    table = load_parameter_table(parameter_cache_directory, content_hash)
+    if table is None:
+        energy_system = load_energy_system(esdl_path)
+        heat_pump_ids = find_heat_pump_ids(energy_system)
+        table = heat_pump_ids, extract_heat_pump_parameters(energy_system, heat_pump_ids)
+        store_parameter_table(parameter_cache_directory, content_hash, *table)
+    heat_pump_ids, all_heat_pump_parameters = table
+
+    esdl_ids = esdl_ids if esdl_ids else heat_pump_ids
+    missing_ids = [esdl_id for esdl_id in esdl_ids if esdl_id not in all_heat_pump_parameters]
+    if missing_ids:
+        raise ValueError(f"Heat pumps {missing_ids} are not present in the energy system")
+    return esdl_ids, {esdl_id: all_heat_pump_parameters[esdl_id] for esdl_id in esdl_ids}
+
+
+def read_weather(weather_path: str) -> dict:
+    # One row per time step with (at least) the columns solar_irradiance, air_temperature and soil_temperature
+    with open(weather_path, newline='') as weather_file:
+        rows = list(csv.DictReader(weather_file))
+    return {name: np.array([float(row[name]) for row in rows]) for name in WEATHER_INPUTS}
+
+
+def read_heat_dispatch(heat_dispatch_path: str, esdl_ids: List[EsdlId], number_of_time_steps: int) -> dict:
+    # One row per time step and heat pump with the columns time_step, esdl_id and the heat powers of the ems.
+    # Heat powers that are not in the file are zero.
+    index = {esdl_id: i for i, esdl_id in enumerate(esdl_ids)}
+    heat_dispatch = {name: np.zeros((number_of_time_steps, len(esdl_ids))) for name in HEAT_DISPATCH_INPUTS}
+    with open(heat_dispatch_path, newline='') as heat_dispatch_file:
+        for row in csv.DictReader(heat_dispatch_file):
+            time_step = int(row['time_step'])
+            if row['esdl_id'] in index and time_step < number_of_time_steps:
+                for name in HEAT_DISPATCH_INPUTS:
+                    heat_dispatch[name][time_step, index[row['esdl_id']]] = float(row[name])
+    return heat_dispatch
+
+
+class CsvOutputSink:
+    def __init__(self, output_path: str, esdl_ids: List[EsdlId], output_names: List[str]):
+        self.esdl_ids = list(esdl_ids)
+        self.output_names = list(output_names)
+        self.output_file = open(output_path, 'w', newline='')
+        self.writer = csv.writer(self.output_file)
+        self.writer.writerow(['time', 'esdl_id'] + self.output_names)
+
+    def record(self, simulation_time: datetime, values: dict):
+        time_column = [simulation_time.isoformat()] * len(self.esdl_ids)
+        columns = [values[output_name].tolist() for output_name in self.output_names]
+        self.writer.writerows(zip(time_column, self.esdl_ids, *columns))
+
+    def close(self):
+        self.output_file.close()
+
+
+def run_offline_simulation(heat_pump_parameters: dict, esdl_ids: List[EsdlId], weather: dict,
+                           heat_dispatch: dict, start_time: datetime, time_step: float, sink=None,
+                           violation_log: Optional[BoundsViolationLog] = None) -> HeatPumpFleet:
+    # heat_pump_parameters as returned by extract_heat_pump_parameters. With a violation_log temperatures out of
+    # their bounds are clamped and recorded instead of terminating the simulation.
+    houses, buffers, dhw_tanks = create_thermal_models(esdl_ids, heat_pump_parameters)
+    fleet = HeatPumpFleet(esdl_ids, houses, buffers, dhw_tanks)
+    fleet.set_bounds({esdl_id: parameters['heat_pump'] for esdl_id, parameters in heat_pump_parameters.items()})
+
+    # Initial temperatures follow from the weather at the first time step, as in send_temperatures
+    fleet.initialise({esdl_id: parameters['heat_pump'] for esdl_id, parameters in heat_pump_parameters.items()},
+                     {esdl_id: parameters['power'] for esdl_id, parameters in heat_pump_parameters.items()},
+                     weather['air_temperature'][0], weather['soil_temperature'][0], weather['solar_irradiance'][0])
+
+    number_of_time_steps = len(heat_dispatch['heat_power_to_house'])
+    if len(weather['air_temperature']) < number_of_time_steps:
+        raise ValueError(f"Weather covers {len(weather['air_temperature'])} of the {number_of_time_steps} time steps")
+    for time_step_number in range(number_of_time_steps):
+        _run_time_step(fleet, weather, heat_dispatch, time_step_number, start_time, time_step, sink, violation_log)
+    return fleet
+
+
+def _run_time_step(fleet: HeatPumpFleet, weather: dict, heat_dispatch: dict, time_step_number: int,
+                   start_time: datetime, time_step: float, sink, violation_log: Optional[BoundsViolationLog]):
+    fleet.set_inputs(weather['air_temperature'][time_step_number],
+                     weather['soil_temperature'][time_step_number],
+                     weather['solar_irradiance'][time_step_number],
+                     heat_dispatch['heat_power_to_tank_dhw'][time_step_number],
+                     heat_dispatch['heat_power_to_dhw'][time_step_number],
+                     heat_dispatch['heat_power_to_buffer'][time_step_number],
+                     heat_dispatch['heat_power_to_house'][time_step_number])
+    fleet.step(time_step)
+    simulation_time = start_time + timedelta(seconds=time_step * time_step_number)
+    fleet.check_bounds(violation_log, simulation_time)
+    if sink is not None:
+        sink.record(simulation_time, {
+            'dhw_tank_temperature': fleet.dhw_temperatures,
+            'buffer_temperature': fleet.buffer_temperatures,
+            'house_temperature': fleet.house_temperatures[:, 0]
+        })
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the heat pump models offline, without HELICS")
+    parser.add_argument("--esdl", required=True, help="ESDL file with the heat pumps and their buildings")
+    parser.add_argument("--weather", required=True, help="csv file with the weather per time step")
+    parser.add_argument("--heat-dispatch", required=True, help="csv file with the heat powers per time step and heat pump")
+    parser.add_argument("--output", required=True,
+                        help="csv file, or directory for the columnar format, the temperatures are written to")
+    parser.add_argument("--output-format", choices=["csv", "columnar"], default="csv")
+    parser.add_argument("--esdl-ids", nargs="+", help="heat pumps to simulate, all heat pumps in the ESDL by default")
+    parser.add_argument("--start-time", default="2024-01-01 00:00:00", help="start time as %%Y-%%m-%%d %%H:%%M:%%S")
+    parser.add_argument("--time-step", type=float, default=900, help="time step in seconds")
+    parser.add_argument("--time-steps", type=int, help="number of time steps, all weather rows by default")
+    parser.add_argument("--parameter-cache", help="directory in which the heat pump parameters are kept per ESDL")
+    parser.add_argument("--clamp-bound-violations", action="store_true",
+                        help="clamp temperatures out of their bounds and report them at the end instead of stopping")
+    args = parser.parse_args(argv)
+
+    esdl_ids, heat_pump_parameters = load_heat_pump_parameters(args.esdl, args.esdl_ids, args.parameter_cache)
+    weather = read_weather(args.weather)
+    number_of_time_steps = args.time_steps if args.time_steps else len(weather['air_temperature'])
+    heat_dispatch = read_heat_dispatch(args.heat_dispatch, esdl_ids, number_of_time_steps)
+    start_time = datetime.strptime(args.start_time, "%Y-%m-%d %H:%M:%S")
+
+    LOGGER.info(f"Simulating {len(esdl_ids)} heat pumps over {number_of_time_steps} time steps")
+    if args.output_format == "columnar":
+        # The output module imports helics through the DOTS infrastructure
+        from heatpumpservice.output import ColumnarFileSink
+        sink = ColumnarFileSink(args.output, esdl_ids, OUTPUT_NAMES, start_time, args.time_step, number_of_time_steps)
+    else:
+        sink = CsvOutputSink(args.output, esdl_ids, OUTPUT_NAMES)
+    violation_log = BoundsViolationLog() if args.clamp_bound_violations else None
+    try:
+        run_offline_simulation(heat_pump_parameters, esdl_ids, weather, heat_dispatch, start_time, args.time_step, sink,
+                               violation_log)
+    finally:
+        sink.close()
+    if violation_log:
+        LOGGER.warning(f"{len(violation_log)} temperatures were clamped to their bounds: "
+                       f"{violation_log.summary(esdl_ids)}")
+
+
+if __name__ == "__main__":
+    main()
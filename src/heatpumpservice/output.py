@@ -0,0 +1,197 @@
+from datetime import datetime
+import glob
+import json
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from dots_infrastructure.DataClasses import EsdlId, SimulaitonDataPoint
+from dots_infrastructure.Logger import LOGGER
+from dots_infrastructure.influxdb_connector import InfluxDBConnector
+
+from heatpumpservice.metrics import HotPathMetrics
+
+
+class BufferedOutputWriter:
+    # Collects the outputs of all heat pumps per time step in columnar (time steps x heat pumps) blocks. The influx
+    # connector only keeps data points in memory until it writes them at the end of the simulation, so the blocks
+    # are kept as arrays and only converted to data points on flush, one extend of the data points per block.
+    # The calculation functions only copy arrays.
+    def __init__(self, influx_connector: InfluxDBConnector, esdl_ids: List[EsdlId], output_names: List[str],
+                 block_time_steps: int = 96, metrics: Optional[HotPathMetrics] = None):
+        self.influx_connector = influx_connector
+        self.esdl_ids = list(esdl_ids)
+        self.output_names = list(output_names)
+        self.block_time_steps = max(1, block_time_steps)
+        self.metrics = metrics
+
+        self._blocks: List[tuple] = []
+        self._times: List[datetime] = []
+        self._columns = self._new_columns()
+
+    def _new_columns(self) -> np.ndarray:
+        # (time steps x heat pumps x outputs), so a block converts to data points in the order of the time steps
+        return np.empty((self.block_time_steps, len(self.esdl_ids), len(self.output_names)))
+
+    def record(self, simulation_time: datetime, values: dict):
+        # values holds one array with a value per heat pump for every output name
+        row = len(self._times)
+        for column, output_name in enumerate(self.output_names):
+            self._columns[row, :, column] = values[output_name]
+        self._times.append(simulation_time)
+        if len(self._times) >= self.block_time_steps:
+            self._close_block()
+
+    def _close_block(self):
+        if self._times:
+            self._blocks.append((self._times, self._columns))
+            self._times = []
+            self._columns = self._new_columns()
+
+    def _write_block(self, times: List[datetime], columns: np.ndarray):
+        values = columns[:len(times)].tolist()
+        self.influx_connector.data_points.extend(
+            SimulaitonDataPoint(output_name, simulation_time, value, esdl_id)
+            for simulation_time, time_step_values in zip(times, values)
+            for esdl_id, heat_pump_values in zip(self.esdl_ids, time_step_values)
+            for output_name, value in zip(self.output_names, heat_pump_values))
+
+    def flush(self):
+        # Hands every recorded time step to the influx connector
+        self._close_block()
+        start_time = time.perf_counter()
+        number_of_time_steps = 0
+        # Blocks are taken off the list as they are written, so a written block can be freed
+        while self._blocks:
+            times, columns = self._blocks.pop(0)
+            self._write_block(times, columns)
+            number_of_time_steps += len(times)
+        LOGGER.debug("Handed %d time steps of %d heat pumps to influx", number_of_time_steps, len(self.esdl_ids))
+        if self.metrics is not None and number_of_time_steps:
+            self.metrics.record("output.influx_write", start_time)
+            self.metrics.count("output.time_steps_written", number_of_time_steps)
+
+    def close(self):
+        self.flush()
+
+
+COLUMNAR_METADATA_FILE = "metadata.json"
+
+
+def columnar_chunk_path(directory: str, output_name: str, chunk_number: int) -> str:
+    return os.path.join(directory, f"{output_name}.{chunk_number:05d}.npy")
+
+
+class ColumnarFileSink:
+    # Writes the outputs of all heat pumps to a directory, without a database. Every output name is one column,
+    # stored as .npy chunks of (chunk time steps x heat pumps) float64, so row t of chunk c holds time step
+    # c * chunk_time_steps + t. Chunks are preallocated memory mapped files within the known simulation horizon,
+    # time steps that are never recorded stay NaN. read_columnar_output maps the chunks back without copying.
+    # A directory that holds chunks of an earlier run is refused, unless the sink resumes that run after a restart:
+    # then the layout of the earlier run is kept and its chunks are reopened.
+    def __init__(self, directory: str, esdl_ids: List[EsdlId], output_names: List[str], start_time: datetime,
+                 time_step_in_seconds: float, number_of_time_steps: int, chunk_time_steps: int = 2976,
+                 resume: bool = False):
+        # By default a chunk holds 31 days of 15 minute time steps
+        self.directory = directory
+        self.esdl_ids = list(esdl_ids)
+        self.output_names = list(output_names)
+        self.start_time = start_time
+        self.time_step_in_seconds = time_step_in_seconds
+        self.number_of_time_steps = number_of_time_steps
+        self.chunk_time_steps = max(1, chunk_time_steps)
+        self.recorded_time_steps = 0
+
+        # Chunk in use per output name, a chunk is mapped when its first time step is recorded
+        self._chunk_number = None
+        self._chunks: dict[str, np.memmap] = {}
+        os.makedirs(directory, exist_ok=True)
+        if resume and os.path.exists(os.path.join(directory, COLUMNAR_METADATA_FILE)):
+            self._resume()
+        elif self._existing_chunks():
+            raise ValueError(f"{directory} holds the output of an earlier run, remove it or restart that run")
+        self._write_metadata()
+
+    def _existing_chunks(self) -> list:
+        return [path for output_name in self.output_names
+                for path in glob.glob(os.path.join(glob.escape(self.directory), f"{glob.escape(output_name)}.*.npy"))]
+
+    def _resume(self):
+        # Continue in the chunks of the earlier run, laid out from its start time
+        with open(os.path.join(self.directory, COLUMNAR_METADATA_FILE)) as metadata_file:
+            metadata = json.load(metadata_file)
+        layout = (self.esdl_ids, self.output_names, self.time_step_in_seconds, self.chunk_time_steps)
+        if (metadata['esdl_ids'], metadata['output_names'], metadata['time_step_in_seconds'],
+                metadata['chunk_time_steps']) != layout:
+            raise ValueError(f"The output in {self.directory} is of other heat pumps, outputs or time steps")
+        self.start_time = datetime.fromisoformat(metadata['start_time'])
+        self.number_of_time_steps = metadata['number_of_time_steps']
+        self.recorded_time_steps = metadata['recorded_time_steps']
+
+    def _write_metadata(self):
+        metadata = {'esdl_ids': self.esdl_ids, 'output_names': self.output_names,
+                    'start_time': self.start_time.isoformat(), 'time_step_in_seconds': self.time_step_in_seconds,
+                    'number_of_time_steps': self.number_of_time_steps, 'chunk_time_steps': self.chunk_time_steps,
+                    'recorded_time_steps': self.recorded_time_steps}
+        with open(os.path.join(self.directory, COLUMNAR_METADATA_FILE), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+
+    def _map_chunk(self, chunk_number: int):
+        self._release_chunks()
+        first_time_step = chunk_number * self.chunk_time_steps
+        shape = (min(self.chunk_time_steps, self.number_of_time_steps - first_time_step), len(self.esdl_ids))
+        for output_name in self.output_names:
+            path = columnar_chunk_path(self.directory, output_name, chunk_number)
+            # Chunks of this run exist when an earlier time step is recorded again or after a restart
+            if os.path.exists(path):
+                chunk = np.lib.format.open_memmap(path, mode='r+')
+            else:
+                chunk = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
+                chunk[...] = np.nan
+            self._chunks[output_name] = chunk
+        self._chunk_number = chunk_number
+
+    def _release_chunks(self):
+        # The metadata follows every released chunk, so it is up to date when the run is interrupted
+        if self._chunks:
+            for chunk in self._chunks.values():
+                chunk.flush()
+            self._write_metadata()
+        self._chunks = {}
+        self._chunk_number = None
+
+    def record(self, simulation_time: datetime, values: dict):
+        # values holds one array with a value per heat pump for every output name
+        time_step = round((simulation_time - self.start_time).total_seconds() / self.time_step_in_seconds)
+        if not 0 <= time_step < self.number_of_time_steps:
+            raise ValueError(f"{simulation_time} is outside the horizon of {self.number_of_time_steps} time steps "
+                             f"of {self.time_step_in_seconds} s from {self.start_time}")
+        chunk_number, row = divmod(time_step, self.chunk_time_steps)
+        if chunk_number != self._chunk_number:
+            self._map_chunk(chunk_number)
+        for output_name in self.output_names:
+            self._chunks[output_name][row] = values[output_name]
+        self.recorded_time_steps = max(self.recorded_time_steps, time_step + 1)
+
+    def flush(self):
+        for chunk in self._chunks.values():
+            chunk.flush()
+        self._write_metadata()
+
+    def close(self):
+        self._release_chunks()
+
+
+def read_columnar_output(directory: str, output_name: str) -> tuple:
+    # (metadata, read only memory maps of the chunks of output_name in time order) of a ColumnarFileSink.
+    # Chunks in which no time step was recorded are None.
+    with open(os.path.join(directory, COLUMNAR_METADATA_FILE)) as metadata_file:
+        metadata = json.load(metadata_file)
+    number_of_chunks = -(-metadata['number_of_time_steps'] // metadata['chunk_time_steps'])
+    chunks = []
+    for chunk_number in range(number_of_chunks):
+        path = columnar_chunk_path(directory, output_name, chunk_number)
+        chunks.append(np.load(path, mmap_mode='r') if os.path.exists(path) else None)
+    return metadata, chunks
@@ -0,0 +1,98 @@
+from collections import Counter
+import time
+from typing import Optional
+
+import helics as h
+from helics.capi import HelicsException, ffi, helicsErrorInitialize, loadSym
+import numpy as np
+
+from dots_infrastructure.DataClasses import CalculationServiceOutput, HelicsCalculationInformation
+from dots_infrastructure.HelicsFederateHelpers import HelicsValueFederateExecutor
+
+from heatpumpservice.metrics import HotPathMetrics
+
+
+def publish_vector(publication: h.HelicsPublication, values: np.ndarray):
+    # Publishes a contiguous float64 array from its own memory, instead of converting it to a list of floats first
+    publish = loadSym("helicsPublicationPublishVector")
+    err = helicsErrorInitialize()
+    publish(publication.handle, ffi.cast("double *", ffi.from_buffer(values)), len(values), err)
+    if err.error_code != 0:
+        raise HelicsException("[" + str(err.error_code) + "] " + ffi.string(err.message).decode())
+
+
+class HeatPumpValueFederateExecutor(HelicsValueFederateExecutor):
+    # Value federate of the heat pump calculations, VECTOR outputs may be returned as views on the fleet state.
+    # Outputs with a deadband are only published when a value moved more than the tolerance away from the value
+    # that was published last for the esdl_id, otherwise the subscribers keep the last published value.
+    # With metrics the time spent waiting on HELICS for time grants and inputs and publishing is recorded.
+    def __init__(self, info: HelicsCalculationInformation, deadbands: Optional[dict] = None,
+                 metrics: Optional[HotPathMetrics] = None):
+        super().__init__(info)
+        self.deadbands = dict(deadbands) if deadbands else {}
+        self.last_published: dict[tuple, np.ndarray] = {}
+        self.published = Counter()
+        self.suppressed = Counter()
+        self.metrics = metrics
+        calculation_name = info.calculation_name
+        self._metric_names = {phase: f"helics.{phase}.{calculation_name}"
+                              for phase in ('time_request', 'gather_inputs', 'publish')}
+
+    def request_new_granted_time(self, granted_time):
+        if self.metrics is None:
+            return super().request_new_granted_time(granted_time)
+        start_time = time.perf_counter()
+        granted_time = super().request_new_granted_time(granted_time)
+        self.metrics.record(self._metric_names['time_request'], start_time)
+        return granted_time
+
+    def _gather_all_required_inputs(self, calculation_params: dict, granted_time):
+        if self.metrics is None:
+            return super()._gather_all_required_inputs(calculation_params, granted_time)
+        start_time = time.perf_counter()
+        granted_time = super()._gather_all_required_inputs(calculation_params, granted_time)
+        self.metrics.record(self._metric_names['gather_inputs'], start_time)
+        return granted_time
+
+    def _publish_outputs(self, esdl_id, pub_values):
+        if self.metrics is None:
+            self._publish_changed_outputs(esdl_id, pub_values)
+        else:
+            start_time = time.perf_counter()
+            self._publish_changed_outputs(esdl_id, pub_values)
+            self.metrics.record(self._metric_names['publish'], start_time)
+
+    def _publish_changed_outputs(self, esdl_id, pub_values):
+        if len(self.helics_value_federate_info.outputs) > 0:
+            outputs = self.output_dict[esdl_id]
+            for output in outputs:
+                value_to_publish = pub_values[output.output_name]
+                if self._within_deadband(esdl_id, output.output_name, value_to_publish):
+                    self.suppressed[output.output_name] += 1
+                else:
+                    self.publish_helics_value(output, value_to_publish)
+                    self.published[output.output_name] += 1
+
+    def _within_deadband(self, esdl_id, output_name: str, value) -> bool:
+        tolerance = self.deadbands.get(output_name)
+        if tolerance is None:
+            return False
+        values = np.asarray(value, dtype=np.float64)
+        last_values = self.last_published.get((esdl_id, output_name))
+        if (last_values is not None and last_values.shape == values.shape and
+                np.max(np.abs(values - last_values), initial=0.0) <= tolerance):
+            return True
+        self.last_published[(esdl_id, output_name)] = values.copy()
+        return False
+
+    def publication_summary(self) -> str:
+        return ", ".join(f"{output_name}: {self.published[output_name]} published, "
+                         f"{self.suppressed[output_name]} suppressed"
+                         for output_name in sorted(set(self.published) | set(self.suppressed)))
+
+    def publish_helics_value(self, helics_output: CalculationServiceOutput, value):
+        if (helics_output.output_type == h.HelicsDataType.VECTOR and isinstance(value, np.ndarray) and
+                value.dtype == np.float64 and value.ndim == 1 and value.flags.c_contiguous):
+            publish_vector(helics_output.helics_publication, value)
+        else:
+            super().publish_helics_value(helics_output, value)
@@ -0,0 +1,49 @@
+from dataclasses import dataclass, field
+import os
+
+
+@dataclass
+class HeatPumpServiceSettings:
+    output_block_time_steps : int = 96
+    checkpoint_path : str = ""
+    checkpoint_interval_in_seconds : float = 21600
+    restart_from_checkpoint : bool = False
+    calculation_period_in_seconds : int = 900
+    publication_deadbands : dict = field(default_factory=dict)
+    subscribers_keep_last_value : bool = False
+    service_import_and_init_time_budget_in_seconds : float = 0.0
+    metrics_path : str = ""
+    clamp_bound_violations : bool = False
+    output_backend : str = "influx"
+    output_directory : str = ""
+
+
+def parse_publication_deadbands(deadbands: str) -> dict:
+    # "output_name:tolerance,output_name:tolerance" to {output_name: tolerance}
+    parsed_deadbands = {}
+    for deadband in deadbands.split(","):
+        if deadband.strip():
+            output_name, tolerance = deadband.split(":")
+            parsed_deadbands[output_name.strip()] = float(tolerance)
+    return parsed_deadbands
+
+
+def get_heat_pump_settings_from_environment() -> HeatPumpServiceSettings:
+    output_block_time_steps = int(os.getenv("output_block_time_steps", "96"))
+    checkpoint_path = os.getenv("checkpoint_path", "")
+    checkpoint_interval_in_seconds = float(os.getenv("checkpoint_interval_in_seconds", "21600"))
+    restart_from_checkpoint = os.getenv("restart_from_checkpoint", "false").lower() in ("true", "1", "yes")
+    calculation_period_in_seconds = int(os.getenv("calculation_period_in_seconds", "900"))
+    publication_deadbands = parse_publication_deadbands(os.getenv("publication_deadbands", ""))
+    subscribers_keep_last_value = os.getenv("subscribers_keep_last_value", "false").lower() in ("true", "1", "yes")
+    service_import_and_init_time_budget_in_seconds = float(os.getenv("service_import_and_init_time_budget_in_seconds", "0.0"))
+    metrics_path = os.getenv("metrics_path", "")
+    clamp_bound_violations = os.getenv("clamp_bound_violations", "false").lower() in ("true", "1", "yes")
+    output_backend = os.getenv("output_backend", "influx")
+    output_directory = os.getenv("output_directory", "")
+    return HeatPumpServiceSettings(output_block_time_steps, checkpoint_path,
+                                   checkpoint_interval_in_seconds, restart_from_checkpoint,
+                                   calculation_period_in_seconds, publication_deadbands,
+                                   subscribers_keep_last_value,
+                                   service_import_and_init_time_budget_in_seconds, metrics_path,
+                                   clamp_bound_violations, output_backend, output_directory)
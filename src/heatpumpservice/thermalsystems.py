@@ -1,15 +1,80 @@
+from dataclasses import dataclass, field
+import itertools
+from typing import List, Sequence
+
 import numpy as np
 from numpy.linalg import inv
-from typing import Optional
 from dots_infrastructure.Logger import LOGGER
 
+from heatpumpservice.lru import LruCache
 
-class House:
-    # solar is left out for now, because we obtain these from the heat profile generator
-    def __init__(self, capacities: dict, resistances: dict, window_area: float):
+
+def zero_order_hold_propagators(capacitances: np.ndarray, K: np.ndarray, K_inv: np.ndarray, time_step: float):
+    # Exact discretisation of C dT/dt = -K T + u with u constant over the time step:
+    # T(t + time_step) = E T(t) + B u, with E = expm(-C^-1 K time_step) and B = (I - E) K^-1.
+    # C is diagonal and K symmetric, so C^-1/2 K C^-1/2 is symmetric and its eigen decomposition is real.
+    # Works on a single house (2 x 2) or on a stack of houses (N x 2 x 2), capacitances holds the diagonals of C.
+    sqrt_capacitances = np.sqrt(capacitances)
+    S = K / (sqrt_capacitances[..., :, None] * sqrt_capacitances[..., None, :])
+    eigenvalues, eigenvectors = np.linalg.eigh(S)
+    decay = np.exp(-eigenvalues * time_step)
+    expm_S = np.matmul(eigenvectors * decay[..., None, :], np.swapaxes(eigenvectors, -1, -2))
+    E = expm_S * sqrt_capacitances[..., None, :] / sqrt_capacitances[..., :, None]
+    B = np.matmul(np.eye(2) - E, K_inv)
+    return E, B
+
+
+def equilibrium_temperatures(K: np.ndarray, K_amb: np.ndarray, window_areas: np.ndarray,
+                             target_indoor_temperatures: np.ndarray, nominal_heats: np.ndarray,
+                             air_temperatures: np.ndarray, soil_temperatures: np.ndarray,
+                             solar_irradiances: np.ndarray):
+    # Steady state 0 = -K T + K_amb T_amb + [window_area * solar_irradiance + heat_to_house, 0] of a stack of
+    # houses (N x 2 x 2), solved in closed form. The heat to the house is the heat that keeps the indoor temperature
+    # at its target, limited to [0, nominal heat]. Returns the (N x 2) temperatures and the required heat per house.
+    forcing = (K_amb[:, :, 0] * np.asarray(air_temperatures, dtype=float)[..., None] +
+               K_amb[:, :, 1] * np.asarray(soil_temperatures, dtype=float)[..., None])
+    forcing[:, 0] += window_areas * solar_irradiances
+
+    # With the indoor temperature at its target the second row gives the envelope temperature, the first the heat
+    envelope_temperatures = (forcing[:, 1] - K[:, 1, 0] * target_indoor_temperatures) / K[:, 1, 1]
+    required_heat_to_house = (K[:, 0, 0] * target_indoor_temperatures + K[:, 0, 1] * envelope_temperatures -
+                              forcing[:, 0])
+    forcing[:, 0] += np.clip(required_heat_to_house, 0.0, nominal_heats)
+
+    determinants = K[:, 0, 0] * K[:, 1, 1] - K[:, 0, 1] * K[:, 1, 0]
+    temperatures = np.empty_like(forcing)
+    temperatures[:, 0] = (K[:, 1, 1] * forcing[:, 0] - K[:, 0, 1] * forcing[:, 1]) / determinants
+    temperatures[:, 1] = (K[:, 0, 0] * forcing[:, 1] - K[:, 1, 0] * forcing[:, 0]) / determinants
+    return temperatures, required_heat_to_house
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True, eq=False)
+class HouseParameters:
+    # Thermal parameter blocks of a house, shared by all houses with the same capacities and resistances.
+    # Compared and hashed by identity, the generated __eq__ and __hash__ would fail on the array fields.
+    C: np.ndarray
+    C_inv: np.ndarray
+    K: np.ndarray
+    K_inv: np.ndarray
+    K_amb: np.ndarray
+    K_amb_inv: np.ndarray
+    A: np.ndarray
+    A_amb: np.ndarray
+    A_inv: np.ndarray
+    k_total: float
+    propagators: dict = field(default_factory=dict, compare=False, repr=False)
+    forecast_operators: dict = field(default_factory=dict, compare=False, repr=False)
+
+    @classmethod
+    def from_description(cls, capacities: dict, resistances: dict):
         # Create capacity matrix and its inverse
-        self.C = np.diag(np.array([capacities['C_in'], capacities['C_out']]))
-        self.C_inv = inv(self.C)
+        C = np.diag(np.array([capacities['C_in'], capacities['C_out']]))
+        C_inv = inv(C)
 
         # Create heat conductance matrices and their inverse
         k_exch = 1.0 / resistances['R_exch']
@@ -19,82 +84,269 @@ class House:
 
         # Estimate total conductance with parallel circuit of floor, transm, and ventilation
         k_transm = 1.0/(1.0/k_exch + 1.0/k_cond)  # in series
-        self.k_total = k_floor + k_transm + k_vent
+        k_total = k_floor + k_transm + k_vent
 
-        self.K = np.array([[k_vent + k_exch + k_floor, -k_exch], [-k_exch, k_cond + k_exch]])
-        self.K_amb = np.array([[k_vent, k_floor], [k_cond, 0]])
+        K = np.array([[k_vent + k_exch + k_floor, -k_exch], [-k_exch, k_cond + k_exch]])
+        K_amb = np.array([[k_vent, k_floor], [k_cond, 0]])
 
         # Note that both K and K_amb are diagonally dominant and thus invertible
-        self.K_inv = inv(self.K)
-        self.K_amb_inv = inv(self.K_amb)
+        K_inv = inv(K)
+        K_amb_inv = inv(K_amb)
 
         # precomputed matrices
-        self.A = np.matmul(self.C_inv, self.K)
-        self.A_amb = np.matmul(self.C_inv, self.K_amb)
-        self.A_inv = inv(self.A)
+        A = np.matmul(C_inv, K)
+        A_amb = np.matmul(C_inv, K_amb)
+        A_inv = inv(A)
+
+        return cls(*(_read_only(matrix) for matrix in (C, C_inv, K, K_inv, K_amb, K_amb_inv, A, A_amb, A_inv)),
+                   k_total)
+
+    def get_propagators(self, time_step: float):
+        # (E, B) of the exact discretisation, computed once per parameter set and time step
+        if time_step not in self.propagators:
+            E, B = zero_order_hold_propagators(np.diag(self.C), self.K, self.K_inv, time_step)
+            self.propagators[time_step] = (_read_only(E), _read_only(B))
+        return self.propagators[time_step]
+
+    def get_forecast_operators(self, time_step: float, horizon: int):
+        # Linear maps from the current temperatures, the ambient temperatures and the heat to the indoor node over the
+        # horizon to the temperatures after each of the horizon steps, with the inputs held per step:
+        # T_k = E^k T_0 + sum_{j<k} E^(k-1-j) B (K_amb T_amb_j + [q_j, 0])
+        # Returns (E^k for k = 1..horizon, (2 horizon x 2 horizon) ambient map, (2 horizon x horizon) heat map),
+        # the rows of the maps are ordered as (step, node).
+        key = (time_step, horizon)
+        if key not in self.forecast_operators:
+            E, B = self.get_propagators(time_step)
+            powers = np.empty((horizon, 2, 2))
+            powers[0] = E
+            for k in range(1, horizon):
+                powers[k] = np.matmul(E, powers[k - 1])
+            # impulse responses E^m B for m = 0..horizon-1
+            impulse_responses = np.empty((horizon, 2, 2))
+            impulse_responses[0] = B
+            impulse_responses[1:] = np.matmul(powers[:-1], B)
+
+            steps = np.arange(horizon)
+            delays = steps[:, None] - steps[None, :]
+            causal = delays >= 0
+            responses = impulse_responses[np.where(causal, delays, 0)] * causal[:, :, None, None]
+            ambient_map = np.matmul(responses, self.K_amb).transpose(0, 2, 1, 3).reshape(2 * horizon, 2 * horizon)
+            heat_map = responses[:, :, :, 0].transpose(0, 2, 1).reshape(2 * horizon, horizon)
+            self.forecast_operators[key] = (_read_only(powers), _read_only(ambient_map), _read_only(heat_map))
+        return self.forecast_operators[key]
+
+
+class HouseParameterCache(LruCache):
+    # Content keyed LRU cache of HouseParameters
+    def __init__(self, maxsize: int = 4096):
+        super().__init__(maxsize)
+
+    def get(self, capacities: dict, resistances: dict) -> HouseParameters:
+        key = (float(capacities['C_in']), float(capacities['C_out']),
+               float(resistances['R_exch']), float(resistances['R_floor']),
+               float(resistances['R_vent']), float(resistances['R_cond']))
+        return self.get_or_create(key, lambda: HouseParameters.from_description(capacities, resistances))
+
+
+HOUSE_PARAMETER_CACHE = HouseParameterCache()
+
+
+class House:
+    # solar is left out for now, because we obtain these from the heat profile generator
+    # The temperatures are a fixed (2) float64 array, which can be bound to a row of the state block of a fleet
+    __slots__ = ('parameters', 'C', 'C_inv', 'k_total', 'K', 'K_amb', 'K_inv', 'K_amb_inv', 'A', 'A_amb', 'A_inv',
+                 'exponential_matrix', 'input_matrix', 'propagator_time_step', 'window_area', 'shgc',
+                 '_temperatures', '_forcing', '_propagated')
+
+    def __init__(self, capacities: dict, resistances: dict, window_area: float,
+                 parameter_cache: HouseParameterCache = HOUSE_PARAMETER_CACHE):
+        # The parameter blocks are shared with all houses with the same capacities and resistances
+        self.parameters = parameter_cache.get(capacities, resistances)
+        self.C = self.parameters.C
+        self.C_inv = self.parameters.C_inv
+        self.k_total = self.parameters.k_total
+        self.K = self.parameters.K
+        self.K_amb = self.parameters.K_amb
+        self.K_inv = self.parameters.K_inv
+        self.K_amb_inv = self.parameters.K_amb_inv
+        self.A = self.parameters.A
+        self.A_amb = self.parameters.A_amb
+        self.A_inv = self.parameters.A_inv
 
+        # Propagators of the exact discretisation, computed for the time step in use
         self.exponential_matrix = None
+        self.input_matrix = None
+        self.propagator_time_step = None
 
         self.window_area = window_area
         self.shgc = 0.7  # solar heat gain coefficient
 
-        self.temperatures: Optional[np.array] = None  # fill later if weather conditions are known
+        self._temperatures = np.full(2, np.nan)  # fill later if weather conditions are known
+        # Work arrays of update_temperatures
+        self._forcing = np.empty(2)
+        self._propagated = np.empty(2)
 
     def __str__(self):
         return f'House instance with: \n capacitances:\n {self.C} \n conductances:\n {self.K}\n  and\n {self.K_amb}'
 
+    @property
+    def temperatures(self) -> np.ndarray:
+        return self._temperatures
+
+    @temperatures.setter
+    def temperatures(self, temperatures):
+        self._temperatures[:] = temperatures
+
+    def bind_temperatures(self, temperatures: np.ndarray):
+        # Keep the temperatures in the given (2) float64 view from now on, starting from the current temperatures
+        temperatures[:] = self._temperatures
+        self._temperatures = temperatures
+
     def set_initial_temperatures(self, initial_temp_in: float, nominal_heat: float,
                                  air_temperature: float, soil_temperature: float, solar_irradiance: float):
         # Idea calculate the initial_temp_out by assuming thermal equilibrium between the outside and inside,
-        # we solve for T[1] and heat_to_house
-        # We thus solve
-        # 0 = -K T + K_amb T_amb + solar_vector + heat_to_house_vector, for T[1]
-        # We use: K T = T[0]K[:, 0]  + T[1]K[:, 1]
-        # so: [[-1, K21], [0, K22]] [heat_to_house, T[1]] = K_amb T_amb + solar_vector - T[0]K[:, 0]
-        ambient_temperatures = np.array([air_temperature, soil_temperature])
-        solar_vector = np.array([self.window_area * solar_irradiance, 0.0])
-
-        # write like Ax = b
-        A = self.K.copy()
-        A[:, 0] = np.array([-1.0, 0.0])
-        b = np.matmul(self.K_amb, ambient_temperatures) + solar_vector - initial_temp_in * self.K[:, 0].T
-        x = np.linalg.solve(A, b)
-        required_heat_to_house = x[0]
-        LOGGER.info(f"Required heat to house: {required_heat_to_house}")
-        LOGGER.info(f"Nominal heat: {nominal_heat}")
-        heat_to_house = np.clip(required_heat_to_house, 0, nominal_heat)
-        temperatures = np.linalg.solve(self.K, np.matmul(self.K_amb, ambient_temperatures) +
-                                       solar_vector + np.array([heat_to_house, 0]))
-        print(f"Temperatures: {temperatures}")
-        LOGGER.info(f"Target house temperature: {initial_temp_in}")
-        LOGGER.info(f"Initial house temperatures: {temperatures}")
+        # we solve for T[1] and heat_to_house, see equilibrium_temperatures
+        temperatures, required_heat_to_house = equilibrium_temperatures(
+            self.K[None], self.K_amb[None], np.array([self.window_area]), np.array([initial_temp_in]),
+            np.array([nominal_heat]), air_temperature, soil_temperature, solar_irradiance)
+        LOGGER.debug("Required heat to house: %s, initial house temperatures: %s", required_heat_to_house[0],
+                     temperatures[0])
         # If heating was required, it should have been be satisfied by the heat pump and we should be at the set point.
         # If not, the temperature in the house will be higher then the set point
-        if required_heat_to_house >= 0:
-            assert abs(initial_temp_in - temperatures[0]) < 1.0e-3, 'internal temperature should be as provided'
-        self.temperatures = temperatures
+        if required_heat_to_house[0] >= 0:
+            assert abs(initial_temp_in - temperatures[0, 0]) < 1.0e-3, 'internal temperature should be as provided'
+        self.temperatures = temperatures[0]
 
     def get_temperatures(self):
         return self.temperatures
 
+    def set_time_step(self, time_step: float):
+        self.exponential_matrix, self.input_matrix = self.parameters.get_propagators(time_step)
+        self.propagator_time_step = time_step
+
     def update_temperatures(self, time_step: float, air_temperature: float, soil_temperature: float,
                             solar_irradiance: float, heat_to_house: float):
-        # Define help vectors
-        ambient_temperatures = np.array([air_temperature, soil_temperature])
-        solar_vector = np.array([self.window_area * solar_irradiance, 0.0])
-        heat_to_house_vector = np.array([heat_to_house, 0.0])
+        if self.propagator_time_step != time_step:
+            self.set_time_step(time_step)
 
         # Differential equation is:
         # C dT/dt = -K T + K_amb T_amb + solar_vector + heat_to_house_vector
-        self.temperatures += time_step * np.matmul(self.C_inv, - np.matmul(self.K, self.temperatures) +
-                                                   np.matmul(self.K_amb, ambient_temperatures) +
-                                                   solar_vector + heat_to_house_vector)
+        # which is integrated exactly over the time step with the inputs held constant, in place
+        K_amb = self.K_amb
+        forcing = self._forcing
+        forcing[0] = (K_amb[0, 0] * air_temperature + K_amb[0, 1] * soil_temperature +
+                      self.window_area * solar_irradiance + heat_to_house)
+        forcing[1] = K_amb[1, 0] * air_temperature + K_amb[1, 1] * soil_temperature
+        np.matmul(self.exponential_matrix, self._temperatures, out=self._propagated)
+        np.matmul(self.input_matrix, forcing, out=self._temperatures)
+        self._temperatures += self._propagated
+
+
+class HouseEnsemble:
+    # Variants of one house with different capacities and resistances along a scenario axis, for parameter sweeps.
+    # All variants see the same weather and are advanced at once, row s of the (S x 2) temperatures belongs to
+    # scenario s.
+    def __init__(self, capacities: Sequence[dict], resistances: Sequence[dict], window_area,
+                 parameter_cache: HouseParameterCache = HOUSE_PARAMETER_CACHE):
+        if len(capacities) != len(resistances):
+            raise ValueError(f"Got {len(capacities)} capacity and {len(resistances)} resistance variants")
+        self.parameters = [parameter_cache.get(variant_capacities, variant_resistances)
+                           for variant_capacities, variant_resistances in zip(capacities, resistances)]
+        self.scenarios: List[dict] = [{**variant_capacities, **variant_resistances}
+                                      for variant_capacities, variant_resistances in zip(capacities, resistances)]
+        number_of_scenarios = len(self.parameters)
+
+        # Parameters, (S x 2 x 2) blocks and (S) window areas
+        self.capacitances = np.array([np.diag(parameters.C) for parameters in self.parameters])
+        self.K = np.array([parameters.K for parameters in self.parameters])
+        self.K_inv = np.array([parameters.K_inv for parameters in self.parameters])
+        self.K_amb = np.array([parameters.K_amb for parameters in self.parameters])
+        self.window_areas = np.array(np.broadcast_to(window_area, (number_of_scenarios,)), dtype=float)
+
+        # Propagators of the exact discretisation per time step: (E, B K_amb, first column of B)
+        self.propagators: dict[float, tuple] = {}
+
+        self.temperatures = np.full((number_of_scenarios, 2), np.nan)  # fill later if weather conditions are known
+        # Work arrays of update_temperatures
+        self._heat = np.empty(number_of_scenarios)
+        self._propagated = np.empty((number_of_scenarios, 2))
+        self._forced = np.empty((number_of_scenarios, 2))
+        self._ambient_temperatures = np.empty(2)
+
+    @classmethod
+    def parameter_sweep(cls, capacities: dict, resistances: dict, window_area: float, variations: dict,
+                        parameter_cache: HouseParameterCache = HOUSE_PARAMETER_CACHE):
+        # One scenario per combination of the values in variations, {name: values} with the names of the capacities
+        # (C_in, C_out) and resistances (R_exch, R_floor, R_vent, R_cond). Other parameters keep their given value.
+        unknown_names = [name for name in variations if name not in capacities and name not in resistances]
+        if unknown_names:
+            raise ValueError(f"Parameters {unknown_names} are not capacities or resistances of the house")
+        names = list(variations)
+        capacity_variants = []
+        resistance_variants = []
+        for values in itertools.product(*(variations[name] for name in names)):
+            variant = dict(zip(names, values))
+            capacity_variants.append({name: variant.get(name, value) for name, value in capacities.items()})
+            resistance_variants.append({name: variant.get(name, value) for name, value in resistances.items()})
+        return cls(capacity_variants, resistance_variants, window_area, parameter_cache)
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def get_propagators(self, time_step: float):
+        if time_step not in self.propagators:
+            E, B = zero_order_hold_propagators(self.capacitances, self.K, self.K_inv, time_step)
+            self.propagators[time_step] = (_read_only(E), _read_only(np.matmul(B, self.K_amb)),
+                                           _read_only(np.ascontiguousarray(B[:, :, 0])))
+        return self.propagators[time_step]
+
+    def set_initial_temperatures(self, initial_temp_in: float, nominal_heat: float,
+                                 air_temperature: float, soil_temperature: float, solar_irradiance: float):
+        # Every variant in equilibrium with the weather, see House.set_initial_temperatures
+        number_of_scenarios = len(self)
+        temperatures, required_heat_to_house = equilibrium_temperatures(
+            self.K, self.K_amb, self.window_areas, np.full(number_of_scenarios, float(initial_temp_in)),
+            np.full(number_of_scenarios, float(nominal_heat)), air_temperature, soil_temperature, solar_irradiance)
+        heated = required_heat_to_house >= 0
+        assert np.all(np.abs(initial_temp_in - temperatures[heated, 0]) < 1.0e-3), \
+            'internal temperature should be as provided'
+        self.temperatures[:] = temperatures
+
+    def update_temperatures(self, time_step: float, air_temperature: float, soil_temperature: float,
+                            solar_irradiance: float, heat_to_house):
+        # heat_to_house is one heat for all variants or one heat per variant (S)
+        E, B_amb, b_heat = self.get_propagators(time_step)
+        self._ambient_temperatures[0] = air_temperature
+        self._ambient_temperatures[1] = soil_temperature
+        np.multiply(self.window_areas, solar_irradiance, out=self._heat)
+        self._heat += heat_to_house
+        np.matmul(E, self.temperatures[:, :, None], out=self._propagated[:, :, None])
+        np.matmul(B_amb, self._ambient_temperatures, out=self._forced)
+        self._propagated += self._forced
+        np.multiply(b_heat, self._heat[:, None], out=self._forced)
+        np.add(self._propagated, self._forced, out=self.temperatures)
 
 
 class HeatBuffer:
+    # The temperature is a (1) float64 array, which can be bound to an element of the state block of a fleet
+    __slots__ = ('capacitance', '_temperature')
+
     def __init__(self, buffer_capacitance):
         self.capacitance = buffer_capacitance
-        self.temperature: Optional[float] = None
+        self._temperature = np.full(1, np.nan)  # fill later with the initial temperature
+
+    @property
+    def temperature(self) -> float:
+        return float(self._temperature[0])
+
+    @temperature.setter
+    def temperature(self, temperature: float):
+        self._temperature[0] = temperature
+
+    def bind_temperature(self, temperature: np.ndarray):
+        # Keep the temperature in the given (1) float64 view from now on, starting from the current temperature
+        temperature[:] = self._temperature
+        self._temperature = temperature
 
     def set_initial_temperature(self, initial_buffer_temp: float):
         self.temperature = initial_buffer_temp
@@ -104,7 +356,7 @@ class HeatBuffer:
 
     def update_temperature(self, time_step: float, heat_out: float, heat_in: float):
         energy_to_buffer = (heat_in - heat_out) * time_step
-        self.temperature += energy_to_buffer/self.capacitance
+        self._temperature[0] += energy_to_buffer/self.capacitance
 
 
 class objectfunctions:
@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+from heatpumpservice.lru import LruCache
+
+WEATHER_INPUTS = ['solar_irradiance', 'air_temperature', 'soil_temperature']
+
+
+class WeatherForecast(NamedTuple):
+    # Read-only forecast vectors of one weather source at one time, shared by all heat pumps
+    solar_irradiances: np.ndarray
+    air_temperatures: np.ndarray
+    soil_temperatures: np.ndarray
+    ambient_temperatures: np.ndarray  # (samples x 2) air and soil temperatures
+
+
+def weather_source_keys(param_dict: dict) -> tuple:
+    # Subscription keys of the weather inputs in param_dict, in the order of WEATHER_INPUTS,
+    # matched as get_vector_param_with_name does
+    source_keys = dict.fromkeys(WEATHER_INPUTS)
+    for key in param_dict:
+        for key_part in key.split("/"):
+            if key_part in source_keys and source_keys[key_part] is None:
+                source_keys[key_part] = key
+    missing_inputs = [name for name, key in source_keys.items() if key is None]
+    if missing_inputs:
+        raise ValueError(f"Weather inputs {missing_inputs} are missing")
+    return tuple(source_keys.values())
+
+
+def _read_only_vector(values) -> np.ndarray:
+    vector = np.array(values, dtype=np.float64)
+    vector.setflags(write=False)
+    return vector
+
+
+def _decode_forecast(param_dict: dict, source_keys: tuple) -> WeatherForecast:
+    solar_irradiances, air_temperatures, soil_temperatures = (
+        _read_only_vector(param_dict[source_key]) for source_key in source_keys)
+    return WeatherForecast(solar_irradiances, air_temperatures, soil_temperatures,
+                           _read_only_vector(np.stack([air_temperatures, soil_temperatures], axis=1)))
+
+
+class WeatherCache(LruCache):
+    # Decoded weather forecasts keyed by the subscription keys of the weather inputs and the simulation time.
+    # Every heat pump and both calculations subscribe to the same weather source, so a forecast is decoded once
+    # per time step. Small LRU, only the most recent time steps are used.
+    def __init__(self, maxsize: int = 16):
+        super().__init__(maxsize)
+
+    def get(self, param_dict: dict, simulation_time: datetime) -> WeatherForecast:
+        source_keys = weather_source_keys(param_dict)
+        return self.get_or_create((source_keys, simulation_time), lambda: _decode_forecast(param_dict, source_keys))
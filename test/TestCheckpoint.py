@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from heatpumpservice.checkpoint import StateCheckpoint
+
+ESDL_IDS = ["hp-1", "hp-2"]
+START_DATE_TIME = datetime(2024, 1, 1)
+
+
+class TestStateCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "heatpumps.checkpoint")
+        self.house_temperatures = np.array([[292.0, 289.0], [293.0, 288.0]])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_latest_complete_snapshot_is_read(self):
+        # Arrange
+        checkpoint = StateCheckpoint(self.path, ESDL_IDS)
+        checkpoint.write(START_DATE_TIME, self.house_temperatures, np.array([315.0, 316.0]), np.array([318.0, 319.0]))
+        checkpoint.write(START_DATE_TIME + timedelta(hours=6), self.house_temperatures + 1.0,
+                         np.array([317.0, 318.0]), np.array([320.0, 321.0]))
+        del checkpoint
+
+        # Execute
+        snapshot = StateCheckpoint(self.path, ESDL_IDS, resume=True).read_latest()
+
+        # Assert
+        simulation_time, house_temperatures, buffer_temperatures, dhw_temperatures = snapshot
+        self.assertEqual(simulation_time, START_DATE_TIME + timedelta(hours=6))
+        np.testing.assert_array_equal(house_temperatures, self.house_temperatures + 1.0)
+        np.testing.assert_array_equal(buffer_temperatures, [317.0, 318.0])
+        np.testing.assert_array_equal(dhw_temperatures, [320.0, 321.0])
+
+    def test_interrupted_snapshot_is_skipped(self):
+        # Arrange
+        checkpoint = StateCheckpoint(self.path, ESDL_IDS)
+        checkpoint.write(START_DATE_TIME, self.house_temperatures, np.array([315.0, 316.0]), np.array([318.0, 319.0]))
+        checkpoint.write(START_DATE_TIME + timedelta(hours=6), self.house_temperatures, np.array([317.0, 318.0]),
+                         np.array([320.0, 321.0]))
+        checkpoint.snapshots[0, -1] = -1.0
+        checkpoint.snapshots.flush()
+
+        # Execute
+        resumed_checkpoint = StateCheckpoint(self.path, ESDL_IDS, resume=True)
+
+        # Assert
+        self.assertEqual(resumed_checkpoint.read_latest()[0], START_DATE_TIME)
+        with self.assertRaises(ValueError):
+            StateCheckpoint(self.path, ["other-hp"], resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,18 @@
 from datetime import datetime
+import json
+import os
+import shutil
+import tempfile
 import unittest
+
+import numpy as np
+from heatpumpservice.esdl_parameters import extract_heat_pump_parameters
 from heatpumpservice.heatpump_service import CalculationServiceHeatPump
-from dots_infrastructure.DataClasses import SimulatorConfiguration, TimeStepInformation
+from heatpumpservice.output import read_columnar_output
+from heatpumpservice.weather import WEATHER_INPUTS, WeatherCache
+from dots_infrastructure.DataClasses import CalculationServiceOutput, SimulatorConfiguration, TimeStepInformation
 from dots_infrastructure.test_infra.InfluxDBMock import InfluxDBMock
+from dots_infrastructure.Logger import LOGGER
 import helics as h
 from esdl.esdl_handler import EnergySystemHandler
 
@@ -48,6 +58,9 @@ class Test(unittest.TestCase):
         self.assertAlmostEqual(ret_val["buffer_temperature"], expected_buffer_temperature)
         self.assertAlmostEqual(ret_val["house_temperatures"][0], expected_indoor_temperature)
         self.assertAlmostEqual(ret_val["house_temperatures"][1], expected_outdoor_temperature)
+        self.assertEqual(len(ret_val["house_temperature_forecast"]), 2 * len(weather_params["air_temperature"]))
+        self.assertEqual(len(ret_val["house_unit_heat_response"]), 2 * len(weather_params["air_temperature"]))
+        self.assertTrue(all(response > 0.0 for response in ret_val["house_unit_heat_response"]))
 
     def test_update_temperatures(self):
         # Arrange
@@ -67,6 +80,7 @@ class Test(unittest.TestCase):
         # Execute
         service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), "ee3795bd-878c-4b89-9e32-5fc4c74816ce", self.energy_system)
         service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), "ee3795bd-878c-4b89-9e32-5fc4c74816ce", self.energy_system)
+        service.output_writer.flush()
 
         # Assert
         influxdb_outputs = service.influx_connector.data_points
@@ -75,10 +89,286 @@ class Test(unittest.TestCase):
         stored_house_temperature = influxdb_outputs[2].value
         expected_dhw_temperature = 318.6502151044533
         expected_buffer_temperature = 315.93853596915767
-        expected_indoor_temperature = 292.35351659016715
+        expected_indoor_temperature = 292.3550214830903
         self.assertAlmostEqual(stored_dhw_tank_temperature, expected_dhw_temperature)
         self.assertAlmostEqual(stored_buffer_temperature, expected_buffer_temperature)
         self.assertAlmostEqual(stored_house_temperature, expected_indoor_temperature)
 
+    def test_restart_from_checkpoint(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        service = CalculationServiceHeatPump()
+        service.influx_connector = InfluxDBMock()
+        service.settings.checkpoint_path = os.path.join(directory.name, "heatpumps.checkpoint")
+        service.init_calculation_service(self.energy_system)
+        input_params = {
+            "solar_irradiance": [0.0] * 48,
+            "air_temperature": [284.65] * 48,
+            "soil_temperature": [290.05] * 48,
+            "heat_power_to_tank_dhw": 2000,
+            "heat_power_to_buffer": 1000,
+            "heat_power_to_dhw": 0,
+            "heat_power_to_house": 20
+        }
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,3), esdl_id, self.energy_system)
+        service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,3), esdl_id, self.energy_system)
+        expected_temperatures = service.send_temperatures(input_params, datetime(2024,1,1,0,15), TimeStepInformation(2,3), esdl_id, self.energy_system)
+        service.update_temperatures(input_params, datetime(2024,1,1,0,15), TimeStepInformation(2,3), esdl_id, self.energy_system)
+        expected_next_temperatures = service.send_temperatures(input_params, datetime(2024,1,1,0,30), TimeStepInformation(3,3), esdl_id, self.energy_system)
+
+        # Execute, the snapshot holds the state at the end of the first period, so the simulation restarts there
+        restarted_service = CalculationServiceHeatPump()
+        restarted_service.influx_connector = InfluxDBMock()
+        restarted_service.simulator_configuration.start_time = datetime(2024,1,1,0,15)
+        restarted_service.settings.checkpoint_path = os.path.join(directory.name, "restarted.checkpoint")
+        shutil.copy(service.settings.checkpoint_path, restarted_service.settings.checkpoint_path)
+        shutil.copy(f"{service.settings.checkpoint_path}.json", f"{restarted_service.settings.checkpoint_path}.json")
+        restarted_service.settings.restart_from_checkpoint = True
+        with self.assertNoLogs(LOGGER, level='WARNING'):
+            restarted_service.init_calculation_service(self.energy_system)
+        restarted_temperatures = restarted_service.send_temperatures(input_params, datetime(2024,1,1,0,15), TimeStepInformation(2,3), esdl_id, self.energy_system)
+        restarted_service.update_temperatures(input_params, datetime(2024,1,1,0,15), TimeStepInformation(2,3), esdl_id, self.energy_system)
+        restarted_next_temperatures = restarted_service.send_temperatures(input_params, datetime(2024,1,1,0,30), TimeStepInformation(3,3), esdl_id, self.energy_system)
+
+        # Assert
+        self.assertEqual(restarted_service.last_checkpoint_time, datetime(2024,1,1,0,15))
+        self.assertAlmostEqual(restarted_temperatures["dhw_temperature"], expected_temperatures["dhw_temperature"])
+        self.assertAlmostEqual(restarted_temperatures["buffer_temperature"], expected_temperatures["buffer_temperature"])
+        self.assertEqual(restarted_temperatures["house_temperatures"].tolist(), expected_temperatures["house_temperatures"].tolist())
+        self.assertEqual(restarted_next_temperatures["house_temperatures"].tolist(), expected_next_temperatures["house_temperatures"].tolist())
+        self.assertAlmostEqual(restarted_next_temperatures["dhw_temperature"], expected_next_temperatures["dhw_temperature"])
+
+        # A restart that keeps the original start time is refused before anything is published
+        misaligned_service = CalculationServiceHeatPump()
+        misaligned_service.influx_connector = InfluxDBMock()
+        misaligned_service.settings.checkpoint_path = restarted_service.settings.checkpoint_path
+        misaligned_service.settings.restart_from_checkpoint = True
+        with self.assertRaises(ValueError):
+            misaligned_service.init_calculation_service(self.energy_system)
+
+    def test_calculation_period_is_sub_stepped_over_forecast_samples(self):
+        # Arrange
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        input_params = {
+            "solar_irradiance": [0.0, 50.0] + [100.0] * 46,
+            "air_temperature": [284.65, 283.0] + [282.0] * 46,
+            "soil_temperature": [290.05, 290.0] + [289.9] * 46,
+            "heat_power_to_tank_dhw": 2000,
+            "heat_power_to_buffer": 1000,
+            "heat_power_to_dhw": 0,
+            "heat_power_to_house": 500
+        }
+        shifted_input_params = dict(input_params)
+        for name in ["solar_irradiance", "air_temperature", "soil_temperature"]:
+            shifted_input_params[name] = input_params[name][1:] + input_params[name][-1:]
+        service = CalculationServiceHeatPump()
+        service.influx_connector = InfluxDBMock()
+        service.init_calculation_service(self.energy_system)
+        os.environ["calculation_period_in_seconds"] = "1800"
+        self.addCleanup(os.environ.pop, "calculation_period_in_seconds")
+        coarse_service = CalculationServiceHeatPump()
+        coarse_service.influx_connector = InfluxDBMock()
+        coarse_service.init_calculation_service(self.energy_system)
+
+        # Execute
+        service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), esdl_id, self.energy_system)
+        service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), esdl_id, self.energy_system)
+        service.update_temperatures(shifted_input_params, datetime(2024,1,1,0,15), TimeStepInformation(2,2), esdl_id, self.energy_system)
+        coarse_service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,1), esdl_id, self.energy_system)
+        coarse_service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,1), esdl_id, self.energy_system)
+        service.output_writer.flush()
+        coarse_service.output_writer.flush()
+
+        # Assert
+        self.assertEqual(coarse_service.heatpump_period_in_seconds, 1800)
+        self.assertEqual(coarse_service.calculations[1].helics_value_federate_info.time_period_in_seconds, 1800)
+        for name in ["house_temperatures", "buffer_temperatures", "dhw_temperatures"]:
+            np.testing.assert_allclose(getattr(coarse_service.fleet, name), getattr(service.fleet, name), rtol=1e-12)
+        self.assertEqual([(point.output_name, point.datapoint_time, point.value) for point in coarse_service.influx_connector.data_points],
+                         [(point.output_name, point.datapoint_time, point.value) for point in service.influx_connector.data_points])
+
+    def test_inputs_off_the_calculation_period_are_refused(self):
+        # Arrange
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        input_params = {
+            "solar_irradiance": [0.0] * 48,
+            "air_temperature": [284.65] * 48,
+            "soil_temperature": [290.05] * 48,
+            "heat_power_to_tank_dhw": 2000,
+            "heat_power_to_buffer": 1000,
+            "heat_power_to_dhw": 0,
+            "heat_power_to_house": 20
+        }
+        service = CalculationServiceHeatPump()
+        service.influx_connector = InfluxDBMock()
+        service.init_calculation_service(self.energy_system)
+        service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,3), esdl_id, self.energy_system)
+        service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,3), esdl_id, self.energy_system)
+        house_temperatures = service.fleet.house_temperatures.copy()
+
+        # Execute, the inputs of 00:15 never arrived
+        with self.assertRaises(ValueError):
+            service.update_temperatures(input_params, datetime(2024,1,1,0,30), TimeStepInformation(3,3), esdl_id, self.energy_system)
+
+        # Assert
+        self.assertEqual(service.state_time, datetime(2024,1,1,0,15))
+        self.assertEqual(service.fleet.house_temperatures.tolist(), house_temperatures.tolist())
+
+    def test_publications_within_deadband_are_suppressed(self):
+        # Arrange
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        os.environ["publication_deadbands"] = "dhw_temperature:0.1,house_temperatures:0.05"
+        self.addCleanup(os.environ.pop, "publication_deadbands")
+        os.environ["subscribers_keep_last_value"] = "true"
+        self.addCleanup(os.environ.pop, "subscribers_keep_last_value")
+        service = CalculationServiceHeatPump()
+        calculation = service.calculations[0]
+        calculation.output_dict[esdl_id] = [
+            CalculationServiceOutput(True, "HeatPump", output_name, esdl_id, data_type, "K")
+            for output_name, data_type in [("dhw_temperature", h.HelicsDataType.DOUBLE),
+                                           ("buffer_temperature", h.HelicsDataType.DOUBLE),
+                                           ("house_temperatures", h.HelicsDataType.VECTOR)]]
+        published_values = []
+        calculation.publish_helics_value = lambda output, value: published_values.append((output.output_name, value))
+
+        # Execute
+        for dhw_temperature, house_temperatures in [(318.0, [292.0, 289.0]), (318.05, [292.04, 289.0]),
+                                                    (318.12, [292.06, 289.0])]:
+            calculation._publish_outputs(esdl_id, {"dhw_temperature": dhw_temperature, "buffer_temperature": 315.0,
+                                                   "house_temperatures": np.array(house_temperatures)})
+
+        # Assert
+        self.assertEqual(calculation.deadbands, {"dhw_temperature": 0.1, "house_temperatures": 0.05})
+        self.assertEqual([value for output_name, value in published_values if output_name == "dhw_temperature"],
+                         [318.0, 318.12])
+        self.assertEqual([value.tolist() for output_name, value in published_values if output_name == "house_temperatures"],
+                         [[292.0, 289.0], [292.06, 289.0]])
+        self.assertEqual(calculation.published["buffer_temperature"], 3)
+        self.assertEqual(calculation.suppressed, {"dhw_temperature": 1, "house_temperatures": 1})
+
+    def test_deadbands_are_refused_without_subscribers_keeping_the_last_value(self):
+        # Arrange
+        os.environ["publication_deadbands"] = "dhw_temperature:0.1"
+        self.addCleanup(os.environ.pop, "publication_deadbands")
+
+        # Execute & Assert
+        with self.assertRaises(ValueError):
+            CalculationServiceHeatPump()
+
+    def test_metrics_are_recorded_and_dumped(self):
+        # Arrange
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        service = CalculationServiceHeatPump()
+        service.influx_connector = InfluxDBMock()
+        service.init_calculation_service(self.energy_system)
+        input_params = {
+            "solar_irradiance": [0.0] * 48,
+            "air_temperature": [284.65] * 48,
+            "soil_temperature": [290.05] * 48,
+            "heat_power_to_tank_dhw": 0,
+            "heat_power_to_buffer": 0,
+            "heat_power_to_dhw": 0,
+            "heat_power_to_house": 0
+        }
+
+        # Execute
+        for minute in [0, 15]:
+            service.send_temperatures(input_params, datetime(2024,1,1,0,minute), TimeStepInformation(1,2), esdl_id, self.energy_system)
+            service.update_temperatures(input_params, datetime(2024,1,1,0,minute), TimeStepInformation(1,2), esdl_id, self.energy_system)
+        service.output_writer.flush()
+        json_path = os.path.join(directory.name, "metrics.json")
+        prometheus_path = os.path.join(directory.name, "metrics.prom")
+        service.metrics.dump(json_path)
+        service.metrics.dump(prometheus_path)
+
+        # Assert
+        with open(json_path) as metrics_file:
+            metrics = json.load(metrics_file)
+        latencies = metrics['latencies_in_seconds']
+        for name in ["calculation.send_temperatures", "calculation.update_temperatures", "phase.input_decode",
+                     "phase.model_step", "phase.bounds_check", "phase.output_write"]:
+            self.assertIn(name, latencies)
+        self.assertEqual(latencies["calculation.update_temperatures"]["count"], 2)
+        self.assertEqual(latencies["phase.input_decode"]["count"], 4)
+        self.assertEqual(latencies["phase.initialise"]["count"], 1)
+        self.assertEqual(metrics['counts']["fleet.steps"], 2)
+        self.assertEqual(metrics['counts']["output.time_steps_written"], 2)
+        with open(prometheus_path) as metrics_file:
+            prometheus_lines = metrics_file.read().splitlines()
+        self.assertIn('heatpumpservice_latency_seconds_count{name="phase.model_step"} 2', prometheus_lines)
+        self.assertIn('heatpumpservice_events_total{name="fleet.steps"} 2', prometheus_lines)
+
+    def test_outputs_are_written_to_columnar_files(self):
+        # Arrange
+        esdl_id = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        service = CalculationServiceHeatPump()
+        service.influx_connector = InfluxDBMock()
+        service.settings.output_backend = "columnar"
+        service.settings.output_directory = directory.name
+        service.init_calculation_service(self.energy_system)
+        input_params = {
+            "solar_irradiance": [0.0] * 48,
+            "air_temperature": [284.65] * 48,
+            "soil_temperature": [290.05] * 48,
+            "heat_power_to_tank_dhw": 20,
+            "heat_power_to_buffer": 20,
+            "heat_power_to_dhw": 20,
+            "heat_power_to_house": 20
+        }
+
+        # Execute
+        service.send_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), esdl_id, self.energy_system)
+        service.update_temperatures(input_params, datetime(2024,1,1), TimeStepInformation(1,2), esdl_id, self.energy_system)
+        service.output_writer.close()
+        metadata, chunks = read_columnar_output(directory.name, 'house_temperature')
+
+        # Assert
+        self.assertEqual(len(service.influx_connector.data_points), 0)
+        self.assertEqual(metadata['esdl_ids'], [esdl_id])
+        self.assertEqual(metadata['recorded_time_steps'], 1)
+        self.assertAlmostEqual(chunks[0][0, 0], service.fleet.house_temperatures[0, 0])
+
+    def test_extract_heat_pump_parameters(self):
+        # Execute
+        heat_pump_parameters = extract_heat_pump_parameters(self.energy_system, ["ee3795bd-878c-4b89-9e32-5fc4c74816ce"])
+
+        # Assert
+        parameters = heat_pump_parameters["ee3795bd-878c-4b89-9e32-5fc4c74816ce"]
+        self.assertEqual(parameters["power"], 18500.0)
+        self.assertEqual(parameters["heat_pump"]["dhw_capacitance"], 1254900.0)
+        self.assertEqual(parameters["building"]["A_glass"], 31.39)
+        with self.assertRaises(ValueError):
+            extract_heat_pump_parameters(self.energy_system, ["non-existing-id"])
+
+class TestWeatherCache(unittest.TestCase):
+
+    def test_forecast_is_decoded_once_per_source_and_time(self):
+        # Arrange
+        cache = WeatherCache()
+        weather = [[0.0, 10.0], [284.65, 284.1], [290.05, 290.06]]
+        param_dicts = [{f"EnvironmentalProfiles/{name}/weather-1": values for name, values in zip(WEATHER_INPUTS, weather)}
+                       for _ in range(3)]
+        for param_dict in param_dicts:
+            param_dict["EConnection/heat_power_to_house/ec-1"] = 20.0
+
+        # Execute
+        forecasts = [cache.get(param_dict, datetime(2024,1,1)) for param_dict in param_dicts]
+        later_forecast = cache.get(param_dicts[0], datetime(2024,1,1,0,15))
+
+        # Assert
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertIs(forecasts[1], forecasts[0])
+        self.assertIsNot(later_forecast, forecasts[0])
+        self.assertEqual(forecasts[0].air_temperatures.tolist(), weather[1])
+        self.assertEqual(forecasts[0].ambient_temperatures.tolist(), [[284.65, 290.05], [284.1, 290.06]])
+        self.assertFalse(forecasts[0].solar_irradiances.flags.writeable)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from heatpumpservice.offline import main
+from heatpumpservice.output import read_columnar_output
+
+HEAT_PUMP_ID = "ee3795bd-878c-4b89-9e32-5fc4c74816ce"
+
+
+class TestOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.weather_path = os.path.join(self.directory.name, "weather.csv")
+        self.heat_dispatch_path = os.path.join(self.directory.name, "heat_dispatch.csv")
+        self.output_path = os.path.join(self.directory.name, "output.csv")
+        with open(self.weather_path, "w", newline="") as weather_file:
+            writer = csv.writer(weather_file)
+            writer.writerow(["solar_irradiance", "air_temperature", "soil_temperature"])
+            writer.writerows([[0.0, 284.65, 290.04999999999995] for _ in range(4)])
+        with open(self.heat_dispatch_path, "w", newline="") as heat_dispatch_file:
+            writer = csv.writer(heat_dispatch_file)
+            writer.writerow(["time_step", "esdl_id", "heat_power_to_tank_dhw", "heat_power_to_buffer",
+                             "heat_power_to_dhw", "heat_power_to_house"])
+            writer.writerows([[time_step, HEAT_PUMP_ID, 20, 20, 20, 20] for time_step in range(4)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_offline_simulation_matches_service(self):
+        # Execute
+        main(["--esdl", "test.esdl", "--weather", self.weather_path, "--heat-dispatch", self.heat_dispatch_path,
+              "--output", self.output_path])
+
+        # Assert
+        with open(self.output_path, newline="") as output_file:
+            rows = list(csv.DictReader(output_file))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]["esdl_id"], HEAT_PUMP_ID)
+        self.assertEqual(rows[0]["time"], "2024-01-01T00:00:00")
+        self.assertAlmostEqual(float(rows[0]["dhw_tank_temperature"]), 318.6502151044533)
+        self.assertAlmostEqual(float(rows[0]["buffer_temperature"]), 315.93853596915767)
+        self.assertAlmostEqual(float(rows[0]["house_temperature"]), 292.3550214830903)
+        self.assertLess(float(rows[3]["house_temperature"]), float(rows[0]["house_temperature"]))
+
+    def test_columnar_output_matches_csv_output(self):
+        # Arrange
+        output_directory = os.path.join(self.directory.name, "output")
+        arguments = ["--esdl", "test.esdl", "--weather", self.weather_path, "--heat-dispatch", self.heat_dispatch_path]
+
+        # Execute
+        main(arguments + ["--output", self.output_path])
+        main(arguments + ["--output", output_directory, "--output-format", "columnar"])
+
+        # Assert
+        with open(self.output_path, newline="") as output_file:
+            rows = list(csv.DictReader(output_file))
+        metadata, chunks = read_columnar_output(output_directory, "house_temperature")
+        self.assertEqual(metadata['recorded_time_steps'], 4)
+        self.assertEqual(chunks[0][:, 0].tolist(), [float(row["house_temperature"]) for row in rows])
+
+    def test_parameter_cache_skips_parsing_the_esdl(self):
+        # Arrange
+        cache_directory = os.path.join(self.directory.name, "parameters")
+        arguments = ["--esdl", "test.esdl", "--weather", self.weather_path, "--heat-dispatch", self.heat_dispatch_path,
+                     "--output", self.output_path, "--parameter-cache", cache_directory]
+        main(arguments)
+        with open(self.output_path, newline="") as output_file:
+            expected_rows = list(csv.DictReader(output_file))
+
+        # Execute, in a fresh interpreter to see which modules are imported
+        script = (f"import sys\nfrom heatpumpservice.offline import main\nmain({arguments!r})\n"
+                  "print(sorted(module for module in ('esdl', 'pyecore', 'helics') if module in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+
+        # Assert
+        self.assertEqual(len(os.listdir(cache_directory)), 1)
+        self.assertEqual(result.stdout.strip(), "[]")
+        with open(self.output_path, newline="") as output_file:
+            self.assertEqual(list(csv.DictReader(output_file)), expected_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+import tempfile
+import unittest
+
+import numpy as np
+
+from dots_infrastructure.test_infra.InfluxDBMock import InfluxDBMock
+
+from heatpumpservice.output import BufferedOutputWriter, ColumnarFileSink, read_columnar_output
+
+ESDL_IDS = ["hp-1", "hp-2"]
+OUTPUT_NAMES = ['dhw_tank_temperature', 'buffer_temperature', 'house_temperature']
+START_DATE_TIME = datetime(2024, 1, 1)
+
+
+def record_time_steps(writer: BufferedOutputWriter, number_of_time_steps: int):
+    for time_step in range(number_of_time_steps):
+        writer.record(START_DATE_TIME + timedelta(seconds=900 * time_step), {
+            output_name: np.array([100.0 * i + time_step for i in range(len(ESDL_IDS))]) + j
+            for j, output_name in enumerate(OUTPUT_NAMES)
+        })
+
+
+class TestBufferedOutputWriter(unittest.TestCase):
+
+    def test_outputs_are_handed_over_on_flush(self):
+        # Arrange
+        influx_connector = InfluxDBMock()
+        writer = BufferedOutputWriter(influx_connector, ESDL_IDS, OUTPUT_NAMES, block_time_steps=4)
+
+        # Execute
+        record_time_steps(writer, 6)
+        points_before_flush = len(influx_connector.data_points)
+        writer.flush()
+        points_after_flush = len(influx_connector.data_points)
+
+        # Assert
+        self.assertEqual(points_before_flush, 0)
+        self.assertEqual(points_after_flush, 6 * len(ESDL_IDS) * len(OUTPUT_NAMES))
+        first_points = influx_connector.data_points[:3]
+        self.assertEqual([point.output_name for point in first_points], OUTPUT_NAMES)
+        self.assertEqual([point.value for point in first_points], [0.0, 1.0, 2.0])
+        self.assertEqual(influx_connector.data_points[3].esdl_id, "hp-2")
+        self.assertEqual(influx_connector.data_points[4 * len(ESDL_IDS) * len(OUTPUT_NAMES)].datapoint_time,
+                         START_DATE_TIME + timedelta(seconds=900 * 4))
+
+    def test_close_writes_remaining_outputs(self):
+        # Arrange
+        influx_connector = InfluxDBMock()
+        writer = BufferedOutputWriter(influx_connector, ESDL_IDS, OUTPUT_NAMES, block_time_steps=96)
+
+        # Execute
+        record_time_steps(writer, 5)
+        writer.close()
+
+        # Assert
+        self.assertEqual(len(influx_connector.data_points), 5 * len(ESDL_IDS) * len(OUTPUT_NAMES))
+        last_point = influx_connector.data_points[-1]
+        self.assertEqual(last_point.datapoint_time, START_DATE_TIME + timedelta(seconds=900 * 4))
+        self.assertEqual(last_point.value, 106.0)
+
+
+class TestColumnarFileSink(unittest.TestCase):
+
+    def test_outputs_are_written_to_chunked_columns(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 10, chunk_time_steps=4)
+
+        # Execute
+        record_time_steps(sink, 6)
+        sink.close()
+        metadata, chunks = read_columnar_output(directory.name, 'buffer_temperature')
+
+        # Assert, time steps 6 up to 10 were not recorded
+        self.assertEqual(metadata['esdl_ids'], ESDL_IDS)
+        self.assertEqual(metadata['recorded_time_steps'], 6)
+        self.assertEqual([chunk.shape if chunk is not None else None for chunk in chunks], [(4, 2), (4, 2), None])
+        self.assertIsInstance(chunks[0], np.memmap)
+        np.testing.assert_array_equal(chunks[0][:, 1], [101.0, 102.0, 103.0, 104.0])
+        np.testing.assert_array_equal(chunks[1][:2, 0], [5.0, 6.0])
+        self.assertTrue(np.isnan(chunks[1][2:]).all())
+
+    def test_metadata_follows_completed_chunks(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 10, chunk_time_steps=4)
+        self.addCleanup(sink.close)
+
+        # Execute, the first chunk is completed when time step 4 is recorded
+        record_time_steps(sink, 5)
+        metadata, _ = read_columnar_output(directory.name, 'buffer_temperature')
+
+        # Assert
+        self.assertEqual(metadata['recorded_time_steps'], 4)
+
+    def test_directory_of_an_earlier_run_is_refused(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        earlier_sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 10,
+                                        chunk_time_steps=4)
+        record_time_steps(earlier_sink, 2)
+        earlier_sink.close()
+
+        # Execute & Assert
+        with self.assertRaises(ValueError):
+            ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 10, chunk_time_steps=4)
+        with self.assertRaises(ValueError):
+            ColumnarFileSink(directory.name, ESDL_IDS[:1], OUTPUT_NAMES, START_DATE_TIME, 900, 10,
+                             chunk_time_steps=4, resume=True)
+        self.assertEqual(read_columnar_output(directory.name, 'buffer_temperature')[0]['recorded_time_steps'], 2)
+
+    def test_restarted_run_continues_in_its_chunks(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        earlier_sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 10,
+                                        chunk_time_steps=4)
+        record_time_steps(earlier_sink, 6)
+        earlier_sink.close()
+
+        # Execute, the restarted run starts at time step 5 and has a shorter horizon of its own
+        restart_time = START_DATE_TIME + timedelta(seconds=900 * 5)
+        sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, restart_time, 900, 5, chunk_time_steps=4,
+                                resume=True)
+        sink.record(restart_time, {output_name: np.array([-1.0, -2.0]) for output_name in OUTPUT_NAMES})
+        sink.record(restart_time + timedelta(seconds=900), {output_name: np.array([-3.0, -4.0])
+                                                            for output_name in OUTPUT_NAMES})
+        sink.close()
+        metadata, chunks = read_columnar_output(directory.name, 'buffer_temperature')
+
+        # Assert
+        self.assertEqual(metadata['start_time'], START_DATE_TIME.isoformat())
+        self.assertEqual(metadata['recorded_time_steps'], 7)
+        np.testing.assert_array_equal(chunks[0][:, 1], [101.0, 102.0, 103.0, 104.0])
+        np.testing.assert_array_equal(chunks[1][:, 0], [5.0, -1.0, -3.0, np.nan])
+
+    def test_time_outside_horizon_is_rejected(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sink = ColumnarFileSink(directory.name, ESDL_IDS, OUTPUT_NAMES, START_DATE_TIME, 900, 2)
+        self.addCleanup(sink.close)
+
+        # Execute & Assert
+        with self.assertRaises(ValueError):
+            record_time_steps(sink, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from heatpumpservice.fleet import BoundsViolationLog, HeatPumpFleet
+from heatpumpservice.thermalsystems import HeatBuffer, House, HouseEnsemble, HouseParameterCache
+
+CAPACITIES = {'C_in': 26146400.0, 'C_out': 78439200.0}
+RESISTANCES = {'R_exch': 0.0012422360248447205, 'R_floor': 0.011182795699309515,
+               'R_vent': 0.015427670676349235, 'R_cond': 0.0026857633907758074}
+WINDOW_AREA = 31.39
+TIME_STEP = 900
+
+
+def create_house(scale: float = 1.0):
+    capacities = {name: value * scale for name, value in CAPACITIES.items()}
+    return House(capacities, RESISTANCES, WINDOW_AREA)
+
+
+class TestHouse(unittest.TestCase):
+
+    def test_update_temperatures_is_exact(self):
+        # Arrange
+        house = create_house()
+        initial_temperatures = np.array([292.0, 289.0])
+        forcing = np.matmul(house.K_amb, np.array([283.0, 290.0])) + np.array([WINDOW_AREA * 100.0 + 2000.0, 0.0])
+        reference_temperatures = initial_temperatures.copy()
+        reference_time_step = 0.05
+        for _ in range(int(TIME_STEP / reference_time_step)):
+            reference_temperatures += reference_time_step * np.matmul(house.C_inv, forcing - np.matmul(house.K, reference_temperatures))
+
+        # Execute
+        house.temperatures = initial_temperatures
+        house.update_temperatures(TIME_STEP, 283.0, 290.0, 100.0, 2000.0)
+
+        # Assert
+        np.testing.assert_allclose(house.temperatures, reference_temperatures, atol=1e-6)
+
+    def test_equilibrium_is_preserved_for_low_capacitances(self):
+        # Arrange
+        house = create_house(1.0e-4)
+        ambient_temperatures = np.array([283.0, 290.0])
+        equilibrium = np.linalg.solve(house.K, np.matmul(house.K_amb, ambient_temperatures) + np.array([500.0, 0.0]))
+        house.temperatures = equilibrium.copy()
+
+        # Execute
+        for _ in range(100):
+            house.update_temperatures(TIME_STEP, 283.0, 290.0, 0.0, 500.0)
+
+        # Assert
+        np.testing.assert_allclose(house.temperatures, equilibrium, rtol=1e-12)
+
+
+class TestHouseEnsemble(unittest.TestCase):
+
+    def test_parameter_sweep_covers_all_combinations(self):
+        # Execute
+        ensemble = HouseEnsemble.parameter_sweep(CAPACITIES, RESISTANCES, WINDOW_AREA,
+                                                 {'C_in': [1.0e7, 2.0e7, 3.0e7], 'R_vent': [0.01, 0.02]})
+
+        # Assert
+        self.assertEqual(len(ensemble), 6)
+        self.assertEqual(ensemble.scenarios[5]['C_in'], 3.0e7)
+        self.assertEqual(ensemble.scenarios[5]['R_vent'], 0.02)
+        self.assertEqual(ensemble.scenarios[5]['R_cond'], RESISTANCES['R_cond'])
+        with self.assertRaises(ValueError):
+            HouseEnsemble.parameter_sweep(CAPACITIES, RESISTANCES, WINDOW_AREA, {'R_roof': [0.01]})
+
+    def test_ensemble_matches_individual_houses(self):
+        # Arrange
+        variations = {'C_out': [5.0e7, 7.8e7, 1.2e8], 'R_exch': [0.001, 0.0015], 'R_floor': [0.008, 0.011]}
+        ensemble = HouseEnsemble.parameter_sweep(CAPACITIES, RESISTANCES, WINDOW_AREA, variations)
+        houses = [House({name: scenario[name] for name in CAPACITIES}, {name: scenario[name] for name in RESISTANCES},
+                        WINDOW_AREA) for scenario in ensemble.scenarios]
+        heat_to_house = np.linspace(1000.0, 3000.0, len(ensemble))
+
+        # Execute
+        ensemble.set_initial_temperatures(293.0, 20000.0, 278.0, 285.0, 50.0)
+        for house in houses:
+            house.set_initial_temperatures(293.0, 20000.0, 278.0, 285.0, 50.0)
+        for _ in range(10):
+            ensemble.update_temperatures(TIME_STEP, 276.0, 285.0, 20.0, heat_to_house)
+            for house, heat in zip(houses, heat_to_house):
+                house.update_temperatures(TIME_STEP, 276.0, 285.0, 20.0, heat)
+
+        # Assert
+        np.testing.assert_allclose(ensemble.temperatures, [house.temperatures for house in houses], rtol=1e-12)
+
+
+class TestHouseParameterCache(unittest.TestCase):
+
+    def test_identical_houses_share_parameters(self):
+        # Arrange
+        cache = HouseParameterCache(maxsize=2)
+
+        # Execute
+        house_1 = House(CAPACITIES, RESISTANCES, WINDOW_AREA, cache)
+        house_2 = House(dict(CAPACITIES), dict(RESISTANCES), 10.0, cache)
+        house_3 = House({'C_in': 1.0e7, 'C_out': 5.0e7}, RESISTANCES, WINDOW_AREA, cache)
+
+        # Assert
+        self.assertIs(house_1.parameters, house_2.parameters)
+        self.assertIsNot(house_1.parameters, house_3.parameters)
+        self.assertFalse(house_1.K.flags.writeable)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # Arrange
+        cache = HouseParameterCache(maxsize=2)
+        capacities = [{'C_in': 1.0e7 * (i + 1), 'C_out': 5.0e7} for i in range(3)]
+
+        # Execute
+        first = cache.get(capacities[0], RESISTANCES)
+        cache.get(capacities[1], RESISTANCES)
+        cache.get(capacities[0], RESISTANCES)
+        cache.get(capacities[2], RESISTANCES)
+
+        # Assert
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get(capacities[0], RESISTANCES), first)
+        self.assertEqual(cache.misses, 3)
+        cache.get(capacities[1], RESISTANCES)
+        self.assertEqual(cache.misses, 4)
+
+
+class TestHeatPumpFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.esdl_ids = ["hp-1", "hp-2", "hp-3"]
+        self.houses = {esdl_id: create_house(1.0 + i) for i, esdl_id in enumerate(self.esdl_ids)}
+        self.buffers = {esdl_id: HeatBuffer(1547710.0 * (i + 1)) for i, esdl_id in enumerate(self.esdl_ids)}
+        self.dhw_tanks = {esdl_id: HeatBuffer(1254900.0 * (i + 1)) for i, esdl_id in enumerate(self.esdl_ids)}
+        for i, esdl_id in enumerate(self.esdl_ids):
+            self.houses[esdl_id].temperatures = np.array([292.0 + i, 289.0 + i])
+            self.buffers[esdl_id].set_initial_temperature(315.0 + i)
+            self.dhw_tanks[esdl_id].set_initial_temperature(318.0 + i)
+
+    def test_step_matches_individual_models(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        for esdl_id in self.esdl_ids:
+            fleet.set_state(esdl_id, self.houses[esdl_id], self.buffers[esdl_id], self.dhw_tanks[esdl_id])
+
+        # Execute
+        for i, esdl_id in enumerate(self.esdl_ids):
+            fleet.stage_inputs(esdl_id, 283.0 + i, 290.0, 100.0 * i, 20.0 * i, 10.0, 30.0, 1000.0 * i)
+            self.dhw_tanks[esdl_id].update_temperature(TIME_STEP, 10.0, 20.0 * i)
+            self.buffers[esdl_id].update_temperature(TIME_STEP, 1000.0 * i, 30.0)
+            self.houses[esdl_id].update_temperatures(TIME_STEP, 283.0 + i, 290.0, 100.0 * i, 1000.0 * i)
+        self.assertTrue(fleet.all_inputs_staged())
+        fleet.step(TIME_STEP)
+
+        # Assert
+        self.assertFalse(fleet.all_inputs_staged())
+        for esdl_id in self.esdl_ids:
+            row = fleet.index[esdl_id]
+            np.testing.assert_allclose(fleet.house_temperatures[row], self.houses[esdl_id].temperatures, rtol=1e-12)
+            self.assertAlmostEqual(fleet.buffer_temperatures[row], self.buffers[esdl_id].temperature)
+            self.assertAlmostEqual(fleet.dhw_temperatures[row], self.dhw_tanks[esdl_id].temperature)
+
+    def test_forecast_matches_stepping_the_house(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        for esdl_id in self.esdl_ids:
+            fleet.set_state(esdl_id, self.houses[esdl_id], self.buffers[esdl_id], self.dhw_tanks[esdl_id])
+        horizon = 48
+        air_temperatures = 283.0 + 3.0 * np.sin(np.arange(horizon) / 8.0)
+        soil_temperatures = np.full(horizon, 290.0)
+        solar_irradiances = np.maximum(0.0, 300.0 * np.sin(np.arange(horizon) / 10.0))
+        house = self.houses["hp-2"]
+        heated_house = create_house(2.0)
+        heated_house.temperatures = house.temperatures.copy()
+
+        # Execute
+        forecast, unit_heat_response = fleet.forecast("hp-2", TIME_STEP,
+                                                      np.stack([air_temperatures, soil_temperatures], axis=1),
+                                                      solar_irradiances)
+
+        # Assert
+        self.assertEqual(forecast.shape, (2, horizon))
+        self.assertEqual(unit_heat_response.shape, (2, horizon))
+        for k in range(horizon):
+            house.update_temperatures(TIME_STEP, air_temperatures[k], soil_temperatures[k], solar_irradiances[k], 0.0)
+            heated_house.update_temperatures(TIME_STEP, air_temperatures[k], soil_temperatures[k],
+                                             solar_irradiances[k], 1000.0)
+            np.testing.assert_allclose(forecast[:, k], house.temperatures, rtol=1e-12)
+            np.testing.assert_allclose(forecast[:, k] + 1000.0 * unit_heat_response[:, k], heated_house.temperatures,
+                                       rtol=1e-12)
+
+    def test_initialise_matches_equilibrium_of_individual_houses(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        # The last house is warm enough without heating at its initial temperature
+        targets = {"hp-1": 293.0, "hp-2": 293.0, "hp-3": 280.0}
+        hp_description_dicts = {esdl_id: {'house_temp_0': targets[esdl_id], 'buffer_temp_0': 315.0 + i,
+                                          'dhw_temp_0': 318.0} for i, esdl_id in enumerate(self.esdl_ids)}
+        nominal_heats = {esdl_id: 8000.0 for esdl_id in self.esdl_ids}
+
+        # Execute
+        fleet.initialise(hp_description_dicts, nominal_heats, 278.0, 285.0, 50.0)
+
+        # Assert
+        self.assertTrue(fleet.initialised.all())
+        for esdl_id in self.esdl_ids:
+            house = self.houses[esdl_id]
+            house.set_initial_temperatures(targets[esdl_id], nominal_heats[esdl_id], 278.0, 285.0, 50.0)
+            row = fleet.index[esdl_id]
+            np.testing.assert_allclose(fleet.house_temperatures[row], house.temperatures, rtol=1e-12)
+            self.assertEqual(fleet.buffer_temperatures[row], hp_description_dicts[esdl_id]['buffer_temp_0'])
+            # Equilibrium with the solar gains and without heating for the last house
+            if esdl_id == "hp-3":
+                expected = np.linalg.solve(house.K, np.matmul(house.K_amb, [278.0, 285.0]) +
+                                           [house.window_area * 50.0, 0.0])
+                np.testing.assert_allclose(fleet.house_temperatures[row], expected, rtol=1e-12)
+                self.assertGreater(fleet.house_temperatures[row, 0], 280.0)
+            else:
+                self.assertAlmostEqual(fleet.house_temperatures[row, 0], 293.0)
+
+    def test_initialise_rows_with_their_own_weather(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        hp_description_dicts = {esdl_id: {'house_temp_0': 293.0, 'buffer_temp_0': 315.0, 'dhw_temp_0': 318.0}
+                                for esdl_id in self.esdl_ids}
+        nominal_heats = {esdl_id: 8000.0 for esdl_id in self.esdl_ids}
+        expected_fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        expected_fleet.initialise(hp_description_dicts, nominal_heats, 283.0, 287.0, 200.0)
+
+        # Execute, the first two heat pumps share a weather source, the last one has another
+        fleet.initialise(hp_description_dicts, nominal_heats, 278.0, 285.0, 50.0, [0, 1])
+        initialised_by_first_source = fleet.initialised.copy()
+        fleet.initialise(hp_description_dicts, nominal_heats, 283.0, 287.0, 200.0, [1, 2])
+
+        # Assert
+        self.assertEqual(initialised_by_first_source.tolist(), [True, True, False])
+        self.assertTrue(fleet.initialised.all())
+        np.testing.assert_allclose(fleet.house_temperatures[2], expected_fleet.house_temperatures[2], rtol=1e-12)
+        self.assertFalse(np.allclose(fleet.house_temperatures[1], expected_fleet.house_temperatures[1]))
+
+    def test_bound_models_follow_the_fleet(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        for esdl_id in self.esdl_ids:
+            fleet.set_state(esdl_id, self.houses[esdl_id], self.buffers[esdl_id], self.dhw_tanks[esdl_id])
+        fleet.bind_models(self.houses, self.buffers, self.dhw_tanks)
+
+        # Execute
+        fleet.set_inputs(283.0, 290.0, 100.0, 20.0, 10.0, 30.0, 1000.0)
+        fleet.step(TIME_STEP)
+
+        # Assert
+        for esdl_id in self.esdl_ids:
+            row = fleet.index[esdl_id]
+            self.assertTrue(np.shares_memory(self.houses[esdl_id].temperatures, fleet.state_block))
+            np.testing.assert_array_equal(self.houses[esdl_id].temperatures, fleet.house_temperatures[row])
+            self.assertEqual(self.buffers[esdl_id].temperature, fleet.buffer_temperatures[row])
+            self.assertEqual(self.dhw_tanks[esdl_id].temperature, fleet.dhw_temperatures[row])
+
+    def test_step_allocates_no_arrays(self):
+        # Arrange
+        esdl_ids = [f"hp-{i}" for i in range(1000)]
+        houses = {esdl_id: create_house(1.0 + i % 3) for i, esdl_id in enumerate(esdl_ids)}
+        buffers = {esdl_id: HeatBuffer(1547710.0) for esdl_id in esdl_ids}
+        dhw_tanks = {esdl_id: HeatBuffer(1254900.0) for esdl_id in esdl_ids}
+        fleet = HeatPumpFleet(esdl_ids, houses, buffers, dhw_tanks)
+        fleet.restore_state(np.array([292.0, 289.0]), 315.0, 318.0)
+        fleet.set_inputs(283.0, 290.0, 100.0, 20.0, 10.0, 30.0, 1000.0)
+        fleet.step(TIME_STEP)
+
+        # Execute
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        for _ in range(3):
+            fleet.set_inputs(283.0, 290.0, 100.0, 20.0, 10.0, 30.0, 1000.0)
+            fleet.step(TIME_STEP)
+        _, peak = tracemalloc.get_traced_memory()
+
+        # Assert, an array of the fleet alone would take 8000 bytes
+        self.assertLess(peak, 8000)
+
+    def create_bounded_fleet(self):
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+        for esdl_id in self.esdl_ids:
+            fleet.set_state(esdl_id, self.houses[esdl_id], self.buffers[esdl_id], self.dhw_tanks[esdl_id])
+        fleet.set_bounds({esdl_id: {'dhw_temp_min': 310.0, 'dhw_temp_max': 319.5, 'buffer_temp_min': 310.0,
+                                    'buffer_temp_max': 316.5, 'house_temp_min': 292.5}
+                          for esdl_id in self.esdl_ids})
+        return fleet
+
+    def test_check_bounds_names_every_offending_heat_pump(self):
+        # Arrange, hp-1 is below its house bound, hp-3 above its dhw and buffer bounds
+        fleet = self.create_bounded_fleet()
+        fleet.buffer_temperatures[1] = 316.5 + 0.5e-4
+
+        # Execute & Assert
+        with self.assertRaises(ValueError) as context:
+            fleet.check_bounds()
+        message = str(context.exception)
+        self.assertIn("dhw ['hp-3']", message)
+        self.assertIn("buffer ['hp-3']", message)
+        self.assertIn("house ['hp-1']", message)
+        self.assertNotIn("hp-2", message)
+        # numerical errors up till eps are corrected
+        self.assertAlmostEqual(fleet.buffer_temperatures[1], 316.5 - 1.0e-4)
+
+    def test_check_bounds_clamps_and_records_violations(self):
+        # Arrange
+        fleet = self.create_bounded_fleet()
+        violation_log = BoundsViolationLog()
+
+        # Execute
+        fleet.check_bounds(violation_log, "t0")
+        fleet.check_bounds(violation_log, "t1")
+
+        # Assert, the clamped temperatures are within bounds at the second check and moved eps inside
+        self.assertEqual(len(violation_log), 3)
+        self.assertEqual(violation_log.offending_esdl_ids(fleet.esdl_ids), ["hp-1", "hp-3"])
+        np.testing.assert_allclose(fleet.dhw_temperatures, [318.0, 319.0, 319.5], atol=1.0e-4)
+        np.testing.assert_allclose(fleet.buffer_temperatures, [315.0, 316.0, 316.5], atol=1.0e-4)
+        self.assertAlmostEqual(fleet.house_temperatures[0, 0], 292.5, delta=1.0e-4)
+        self.assertIn("house: 1 violations from t0 to t0, largest excess 0.5 K, heat pumps ['hp-1']",
+                      violation_log.summary(fleet.esdl_ids))
+
+    def test_step_requires_initial_state(self):
+        # Arrange
+        fleet = HeatPumpFleet(self.esdl_ids, self.houses, self.buffers, self.dhw_tanks)
+
+        # Execute & Assert
+        with self.assertRaises(ValueError):
+            fleet.step(TIME_STEP)
+
+
+if __name__ == '__main__':
+    unittest.main()